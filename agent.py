@@ -1,7 +1,10 @@
 import logging
 import time
 import threading
-from typing import Dict, Any, List, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from typing import Dict, Any, Callable, Deque, List, Optional, Tuple
 
 from model_loader import ModelLoader
 
@@ -9,13 +12,60 @@ from model_loader import ModelLoader
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Prefixes of system messages and status updates that should not get a response
+_SKIP_PREFIXES = ("📢", "System:")
+
+# Tokens reserved for the role labels ModelLoader adds around each message
+_TOKEN_SAFETY_MARGIN = 64
+
+class Msg:
+    """
+    Conversation message, recycled through a per-user pool to avoid a new dict per turn
+    """
+    __slots__ = ("role", "content", "tokens")
+    
+    def __init__(self, role: str = "", content: str = "", tokens: int = 0):
+        self.role = role
+        self.content = content
+        self.tokens = tokens  # Token count of content, computed once
+    
+    def __getitem__(self, key):
+        # Dict-style access so ModelLoader can keep treating messages as dicts
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def __repr__(self):
+        return f"Msg(role={self.role!r}, content={self.content!r})"
+
+@dataclass
+class ConvState:
+    """
+    Per-user conversation state
+    
+    The stable prefix (system prompt) is never rewritten or re-ordered, so every
+    prompt built from it starts with the same bytes and the model can reuse the
+    KV cache for that prefix instead of evaluating it again.
+    """
+    stable_prefix: Tuple[Msg, ...]
+    recent: Deque[Msg] = field(default_factory=deque)
+    prefix_tokens: Optional[List[int]] = None
+    pool: List[Msg] = field(default_factory=list)  # Evicted messages ready for reuse
+    recent_tokens: int = 0  # Sum of tokens over recent
+
 class Agent:
     def __init__(
         self,
         model_loader: ModelLoader,
-        meshtastic_client,  # Can be either MeshtasticClient or MeshtasticMqttClient
+        meshtastic_client,  # MeshtasticHybridClient, MeshtasticMqttClient or MeshtasticTcpClient
         system_prompt: str = "You are a helpful AI assistant.",
-        max_conversation_length: int = 10
+        max_conversation_length: int = 10,
+        batch_window_ms: int = 100,
+        max_batch: int = 4,
+        response_timeout: float = 300.0,
+        max_pending: int = 16,
+        max_prompt_tokens: Optional[int] = None,
+        tokenize: Optional[Callable[[str], List[int]]] = None
     ):
         """
         Initialize the conversational agent
@@ -25,20 +75,64 @@ class Agent:
             meshtastic_client: Initialized Meshtastic client instance
             system_prompt: System prompt to guide the LLM's behavior
             max_conversation_length: Maximum length of conversation history
+            batch_window_ms: Time to wait for other users' messages before running a batch
+            max_batch: Maximum number of conversations generated in one model call
+            response_timeout: Seconds to wait for a batched response before giving up
+            max_pending: Maximum number of messages waiting for a response before new ones are dropped
+            max_prompt_tokens: Token budget for the prompt; oldest turns are dropped to stay within it (None to disable)
+            tokenize: Function used to count tokens (defaults to model_loader.tokenize)
         """
         self.model_loader = model_loader
         self.meshtastic_client = meshtastic_client
         self.system_prompt = system_prompt
         self.max_conversation_length = max_conversation_length
         
+        # Without batched decode, waiting for other users only delays every reply
+        if not model_loader.supports_batching():
+            logger.info("Model has no batched decode, generating each request on its own")
+            batch_window_ms = 0
+            max_batch = 1
+        
+        self.batch_window_ms = batch_window_ms
+        self.max_batch = max_batch
+        self.response_timeout = response_timeout
+        self.max_pending = max_pending
+        self.max_prompt_tokens = max_prompt_tokens
+        self._tokenize = tokenize or model_loader.tokenize
+        
         # Conversation history
-        self.conversations = {}  # User ID -> conversation history
+        self.conversations: Dict[str, ConvState] = {}  # User ID -> conversation state
+        self._system_msg = Msg("system", system_prompt)
+        self._stable_prefix = (self._system_msg,)  # Shared by every conversation, never modified
+        self._prefix_tokens = self._tokenize_prefix()
+        
+        # Micro-batching of generation requests across users
+        self._pending: List[Tuple[str, List[Dict[str, str]], Future]] = []
+        self._pending_lock = threading.Lock()
+        self._pending_event = threading.Event()  # Set when there is pending work
+        self._batch_full = threading.Event()  # Set when a full batch is waiting
+        self._running = True
+        self._batch_thread = threading.Thread(target=self._batch_worker, name="llm-batcher")
+        self._batch_thread.daemon = True
+        self._batch_thread.start()
+        
+        # Generation runs on worker threads so the receive path never blocks on the model.
+        # One worker per batch slot lets concurrent users meet in the batcher.
+        self._executor = ThreadPoolExecutor(max_workers=max_batch, thread_name_prefix="llm")
+        self._inflight = set()  # User IDs with a response in progress
+        self._inflight_lock = threading.Lock()
     
     def shutdown(self):
         """
         Shutdown the agent
         """
         logger.info("Shutting down agent")
+        self._running = False
+        self._pending_event.set()
+        self._batch_full.set()
+        if self._batch_thread.is_alive():
+            self._batch_thread.join(timeout=2.0)
+        self._executor.shutdown(wait=False)
         if hasattr(self.meshtastic_client, 'disconnect') and callable(self.meshtastic_client.disconnect):
             self.meshtastic_client.disconnect()
     
@@ -46,108 +140,342 @@ class Agent:
         """
         Process a message from the Meshtastic client
         
+        The response is generated on a worker thread and sent through the
+        Meshtastic client, so this returns as soon as the message is queued.
+        
         Args:
             message: Message object from the Meshtastic client
             
         Returns:
-            str: Response text or None if no response should be sent
+            None: The response is sent asynchronously
         """
         try:
             # Extract message data
             text = message.get('text', '')
             from_id = message.get('from_id', 'unknown')
             
-            # Skip empty messages
-            if not text:
-                logger.warning("Empty message received")
+            if self._should_skip(text):
                 return None
             
-            # Skip messages that are too short (likely noise)
-            if len(text.strip()) < 2:
-                logger.warning(f"Message too short, ignoring: {text}")
-                return None
+            with self._inflight_lock:
+                # Only one request per user at a time
+                if from_id in self._inflight:
+                    logger.warning("Already generating a response for %s, ignoring: %.50s...", from_id, text)
+                    return None
+                
+                # Apply backpressure instead of queueing without bound
+                if len(self._inflight) >= self.max_pending:
+                    logger.warning("Too many pending messages (%s), ignoring message from %s", len(self._inflight), from_id)
+                    return None
+                
+                self._inflight.add(from_id)
             
-            # Skip system messages and status updates
-            if text.startswith("📢") or text.startswith("System:"):
-                logger.info(f"Ignoring system message: {text}")
-                return None
+            logger.info("Queued message from %s for response generation: %.50s...", from_id, text)
+            self._executor.submit(self._generate_and_send, message)
+            return None
             
+        except Exception as e:
+            logger.exception("Error processing message: %s", e)
+            return None
+    
+    def _generate_and_send(self, message):
+        """
+        Generate a response to a message and send it through the Meshtastic client
+        
+        Args:
+            message: Message object from the Meshtastic client
+        """
+        text = message.get('text', '')
+        from_id = message.get('from_id', 'unknown')
+        
+        try:
             # Generate response
-            logger.info(f"Generating response for message from {from_id}: {text[:50]}...")
-            response = self.generate_response(text, user_id=from_id)
+            logger.info("Generating response for message from %s: %.50s...", from_id, text)
+            response = self._generate_response(text, user_id=from_id)
             
             if response:
-                logger.info(f"Generated response for {from_id}: {response[:50]}...")
-                return response
+                logger.info("Generated response for %s: %.50s...", from_id, response)
             else:
                 logger.warning("Failed to generate response")
-                return "I'm sorry, I couldn't generate a response at this time."
+                response = "I'm sorry, I couldn't generate a response at this time."
             
         except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return "I encountered an error processing your message. Please try again."
+            logger.exception("Error processing message: %s", e)
+            response = "I encountered an error processing your message. Please try again."
+        
+        try:
+            self._send_response(message, response)
+        except Exception as e:
+            logger.error("Error sending response to %s: %s", from_id, e)
+        finally:
+            with self._inflight_lock:
+                self._inflight.discard(from_id)
+    
+    def _send_response(self, message, response):
+        """
+        Send a response through the Meshtastic client
+        
+        Args:
+            message: Message object the response answers
+            response: Response text
+        """
+        # The client knows how to route replies (direct, broadcast, LLM channel)
+        self.meshtastic_client.send_response(response, message)
+    
+    def _should_skip(self, text) -> bool:
+        """
+        Check whether a message should be ignored instead of answered
+        
+        Args:
+            text: Message text
+            
+        Returns:
+            bool: True if no response should be generated
+        """
+        # Skip empty messages
+        if not text:
+            logger.warning("Empty message received")
+            return True
+        
+        # Skip messages that are too short (likely noise)
+        if len(text.strip()) < 2:
+            logger.warning("Message too short, ignoring: %s", text)
+            return True
+        
+        # Skip system messages and status updates
+        if text.startswith(_SKIP_PREFIXES):
+            logger.info("Ignoring system message: %s", text)
+            return True
+        
+        return False
     
     def generate_response(self, message, user_id=None):
         """
         Generate a response to a message
         """
+        if self._should_skip(message):
+            return None
+        
+        return self._generate_response(message, user_id=user_id)
+    
+    def _generate_response(self, message, user_id=None):
+        """
+        Generate a response to a message that has already passed _should_skip
+        """
         try:
-            # Skip empty messages
-            if not message:
-                logger.warning("Empty message received")
-                return None
-            
-            # Skip messages that are too short (likely noise)
-            if len(message.strip()) < 2:
-                logger.warning(f"Message too short, ignoring: {message}")
-                return None
-            
-            # Skip system messages and status updates
-            if message.startswith("📢") or message.startswith("System:"):
-                logger.info(f"Ignoring system message: {message}")
-                return None
-            
             # Get or create conversation for this user
             if user_id is None:
                 user_id = "default"
             
             if user_id not in self.conversations:
-                logger.info(f"Creating new conversation for user {user_id}")
-                self.conversations[user_id] = []
-            
-            # Add user message to conversation
-            self.conversations[user_id].append({"role": "user", "content": message})
+                logger.info("Creating new conversation for user %s", user_id)
+                self.conversations[user_id] = ConvState(
+                    stable_prefix=self._stable_prefix,
+                    recent=deque(maxlen=self.max_conversation_length),
+                    prefix_tokens=self._prefix_tokens
+                )
+            state = self.conversations[user_id]
             
-            # Truncate conversation if it's too long
-            if len(self.conversations[user_id]) > self.max_conversation_length:
-                # Keep system message if present, and recent messages
-                if self.conversations[user_id][0]["role"] == "system":
-                    self.conversations[user_id] = [self.conversations[user_id][0]] + self.conversations[user_id][-(self.max_conversation_length-1):]
-                else:
-                    self.conversations[user_id] = self.conversations[user_id][-self.max_conversation_length:]
+            # Add user message to conversation (evicting the oldest turn if full)
+            self._append_msg(state, "user", message)
             
-            # Prepare conversation for model
-            conversation = self.conversations[user_id].copy()
-            
-            # Add system message if not present
-            if len(conversation) == 0 or conversation[0]["role"] != "system":
-                conversation.insert(0, {"role": "system", "content": self.system_prompt})
+            # Prepare conversation for model: prefix first, then recent turns.
+            # The pooled Msg objects are reused by later turns, so the batch
+            # worker gets a snapshot rather than the live messages.
+            conversation = [
+                {"role": msg.role, "content": msg.content}
+                for msg in (*state.stable_prefix, *state.recent)
+            ]
             
             # Generate response
-            logger.debug(f"Generating response for: {message}")
-            response = self.model_loader.generate_response(conversation)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Generating response for: %s", message)
+            response = self._submit(user_id, conversation)
             
             # Add assistant response to conversation
             if response:
-                self.conversations[user_id].append({"role": "assistant", "content": response})
-                logger.info(f"Generated response: {response[:100]}...")
+                self._append_msg(state, "assistant", response)
+                logger.info("Generated response: %.100s...", response)
             else:
                 logger.warning("Failed to generate response")
             
             return response
         
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
+            logger.error("Error generating response: %s", e)
             return "I'm sorry, I encountered an error processing your message."
+    
+    def _append_msg(self, state: ConvState, role: str, content: str):
+        """
+        Append a message to a conversation, evicting the oldest turns if it no
+        longer fits and reusing the message objects they free
+        
+        Args:
+            state: Conversation state to append to
+            role: Message role
+            content: Message content
+        """
+        recent = state.recent
+        if len(recent) == recent.maxlen:
+            self._evict_oldest(state)
+        
+        tokens = self._count_tokens(content) if self.max_prompt_tokens else 0
+        
+        if state.pool:
+            msg = state.pool.pop()
+            msg.role = role
+            msg.content = content
+            msg.tokens = tokens
+        else:
+            msg = Msg(role, content, tokens)
+        
+        recent.append(msg)
+        state.recent_tokens += tokens
+        
+        # Keep the next prompt within the token budget, always keeping the newest message.
+        # Only checked for user turns, since that is when a prompt is built.
+        if self.max_prompt_tokens and role == "user":
+            budget = self.max_prompt_tokens - len(state.prefix_tokens or ()) - _TOKEN_SAFETY_MARGIN
+            while state.recent_tokens > budget and len(recent) > 1:
+                self._evict_oldest(state)
+    
+    def _evict_oldest(self, state: ConvState):
+        """
+        Remove the oldest recent message and return it to the pool
+        
+        Args:
+            state: Conversation state to evict from
+        """
+        evicted = state.recent.popleft()
+        state.recent_tokens -= evicted.tokens
+        if len(state.pool) < 2 * self.max_conversation_length:
+            state.pool.append(evicted)
+    
+    def _count_tokens(self, text: str) -> int:
+        """
+        Count the tokens in a message, estimating if the tokenizer fails
+        """
+        try:
+            return len(self._tokenize(text))
+        except Exception as e:
+            logger.warning("Could not tokenize message, estimating token count: %s", e)
+            return len(text) // 4 + 1
+    
+    def _tokenize_prefix(self) -> Optional[List[int]]:
+        """
+        Tokenize the system prompt once so it can be shared by all conversations
+        """
+        try:
+            return self._tokenize(self.system_prompt)
+        except Exception as e:
+            logger.warning("Could not tokenize system prompt: %s", e)
+            return None
+    
+    def _submit(self, user_id: str, conversation: List[Dict[str, str]]) -> str:
+        """
+        Queue a conversation for the batch worker and wait for its response
+        
+        Args:
+            user_id: ID of the user the conversation belongs to
+            conversation: Conversation to generate a response for
+            
+        Returns:
+            str: Generated response
+        """
+        future = Future()
+        with self._pending_lock:
+            self._pending.append((user_id, conversation, future))
+            if len(self._pending) >= self.max_batch:
+                self._batch_full.set()
+        self._pending_event.set()
+        
+        try:
+            return future.result(timeout=self.response_timeout)
+        except FutureTimeoutError:
+            # Don't generate a response nobody is waiting for
+            with self._pending_lock:
+                self._pending = [item for item in self._pending if item[2] is not future]
+            future.cancel()
+            raise
+    
+    def _take_batch(self) -> List[Tuple[str, List[Dict[str, str]], Future]]:
+        """
+        Remove up to max_batch pending requests from distinct users
+        
+        A second request from the same user depends on the reply to the first,
+        so it is left in the queue for the next batch.
+        """
+        with self._pending_lock:
+            batch = []
+            remaining = []
+            users = set()
+            for item in self._pending:
+                if len(batch) < self.max_batch and item[0] not in users:
+                    users.add(item[0])
+                    batch.append(item)
+                else:
+                    remaining.append(item)
+            self._pending = remaining
+            
+            if not remaining:
+                self._pending_event.clear()
+            if len(remaining) < self.max_batch:
+                self._batch_full.clear()
+        
+        return batch
+    
+    @staticmethod
+    def _group_by_length(batch):
+        """
+        Split a batch into groups of similar prompt length to limit padding waste
+        """
+        def prompt_length(item):
+            return sum(len(message["content"]) for message in item[1])
+        
+        groups = []
+        group_start_length = None
+        for item in sorted(batch, key=prompt_length):
+            length = prompt_length(item)
+            # Start a new group once prompts are more than twice as long as the shortest in the group
+            if group_start_length is None or length > 2 * max(group_start_length, 1):
+                groups.append([])
+                group_start_length = length
+            groups[-1].append(item)
+        
+        return groups
+    
+    def _batch_worker(self):
+        """
+        Collect pending requests for batch_window_ms and generate them together
+        """
+        while self._running:
+            if not self._pending_event.wait(timeout=1.0):
+                continue
+            
+            # Give other users a short window to join this batch, unless it is already full
+            self._batch_full.wait(timeout=self.batch_window_ms / 1000.0)
+            if not self._running:
+                break
+            
+            # Mark the requests as running; ones cancelled after timing out are dropped
+            batch = [item for item in self._take_batch() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            
+            for group in self._group_by_length(batch):
+                logger.info("Generating batch of %s response(s)", len(group))
+                try:
+                    responses = self.model_loader.generate_batch([conversation for _, conversation, _ in group])
+                    for (_, _, future), response in zip(group, responses):
+                        future.set_result(response)
+                except Exception as e:
+                    logger.error("Error generating batch: %s", e)
+                    for _, _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+        
+        # Release anyone still waiting on a response
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for _, _, future in pending:
+            future.set_exception(RuntimeError("Agent is shutting down"))
@@ -2,9 +2,14 @@
 MODEL_ID = "TheBloke/Mistral-7B-Instruct-v0.2-GGUF"
 MODEL_LOCAL_PATH = "./models/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
 USE_GGUF = True  # Set to True if loading a GGUF model file
+LLM_BACKEND = "transformers"  # Backend for non-GGUF models: "transformers" or "vllm" (pip install vllm)
+QUANT_FORMAT = None  # transformers only: "gptq", "awq", "fp8", "bnb4" or "none" (None: bnb4 on CUDA unless the model is pre-quantized)
 MAX_NEW_TOKENS = 512
 TEMPERATURE = 0.7
 TOP_P = 0.9
+BATCH_WINDOW_MS = 100  # Time to collect concurrent messages into one model call
+MAX_BATCH_SIZE = 4  # Maximum number of conversations generated together
+MAX_PROMPT_TOKENS = 3072  # Token budget for conversation history sent to the model
 
 # Meshtastic configuration
 MESHTASTIC_IP = "10.0.0.133"
@@ -9,6 +9,7 @@ import os
 import sys
 import time
 import json
+import hashlib
 import logging
 import argparse
 import meshtastic
@@ -40,10 +41,14 @@ class MeshtasticConfigurator:
         self.config_applied = False
         self.device_info = {}
         
+        # Cached device reads, each one is a round-trip over serial/TCP
+        self._channel_cache = None
+        self._mqtt_config_cache = None
+        
     def connect(self):
         """Connect to the Meshtastic device"""
         try:
-            logger.info(f"Connecting to Meshtastic device via {self.interface_type}...")
+            logger.info("Connecting to Meshtastic device via %s...", self.interface_type)
             
             if self.interface_type == "tcp":
                 # Connect via TCP
@@ -51,13 +56,13 @@ class MeshtasticConfigurator:
                     hostname=self.tcp_host, 
                     port=self.tcp_port
                 )
-                logger.info(f"Connected to device via TCP at {self.tcp_host}:{self.tcp_port}")
+                logger.info("Connected to device via TCP at %s:%s", self.tcp_host, self.tcp_port)
             else:
                 # Connect via serial
                 self.interface = meshtastic.serial_interface.SerialInterface(
                     devPath=self.serial_port
                 )
-                logger.info(f"Connected to device via Serial at {self.serial_port or 'auto-detected port'}")
+                logger.info("Connected to device via Serial at %s", self.serial_port or 'auto-detected port')
                 
             # Subscribe to node info updates
             pub.subscribe(self._on_node_info, "meshtastic.node.info")
@@ -69,7 +74,7 @@ class MeshtasticConfigurator:
             return True
             
         except Exception as e:
-            logger.error(f"Error connecting to Meshtastic device: {str(e)}")
+            logger.error("Error connecting to Meshtastic device: %s", e)
             return False
             
     def _on_node_info(self, packet, interface):
@@ -85,9 +90,9 @@ class MeshtasticConfigurator:
                     'hardware_model': packet.get('deviceMetrics', {}).get('hardware', 'Unknown'),
                     'firmware_version': packet.get('deviceMetrics', {}).get('firmwareVersion', 'Unknown'),
                 }
-                logger.info(f"Device Info: {json.dumps(self.device_info, indent=2)}")
+                logger.info("Device Info: %s", json.dumps(self.device_info, indent=2))
         except Exception as e:
-            logger.error(f"Error processing node info: {str(e)}")
+            logger.error("Error processing node info: %s", e)
             
     def configure_mqtt(self, mqtt_server, mqtt_username=None, mqtt_password=None, 
                        mqtt_enabled=True, mqtt_port=1883, encryption_enabled=True):
@@ -97,10 +102,10 @@ class MeshtasticConfigurator:
             return False
             
         try:
-            logger.info(f"Configuring MQTT settings: Server={mqtt_server}:{mqtt_port}, Enabled={mqtt_enabled}")
+            logger.info("Configuring MQTT settings: Server=%s:%s, Enabled=%s", mqtt_server, mqtt_port, mqtt_enabled)
             
             # Get the current device config
-            orig_mqtt = self.interface.getConfig("mqtt")
+            orig_mqtt = self._get_mqtt_config()
             
             # Construct the new MQTT config
             mqtt_config = {
@@ -113,16 +118,12 @@ class MeshtasticConfigurator:
             }
             
             # Check if we need to update
-            config_changed = (orig_mqtt.get('address') != mqtt_config['address'] or
-                             orig_mqtt.get('username') != mqtt_config['username'] or
-                             orig_mqtt.get('password') != mqtt_config['password'] or
-                             orig_mqtt.get('enabled') != mqtt_config['enabled'] or
-                             orig_mqtt.get('port') != mqtt_config['port'] or
-                             orig_mqtt.get('encryption_enabled') != mqtt_config['encryption_enabled'])
+            config_changed = {key: orig_mqtt.get(key) for key in mqtt_config} != mqtt_config
             
             if config_changed:
                 logger.info("Applying new MQTT configuration...")
                 self.interface.setMQTT(**mqtt_config)
+                self._mqtt_config_cache = None
                 logger.info("MQTT configuration updated successfully")
                 return True
             else:
@@ -130,80 +131,103 @@ class MeshtasticConfigurator:
                 return True
                 
         except Exception as e:
-            logger.error(f"Error configuring MQTT: {str(e)}")
+            logger.error("Error configuring MQTT: %s", e)
             return False
             
     def configure_channel(self, channel_name="LLM", modem_config=9, psk=None, 
-                         downlink_enabled=True, uplink_enabled=True, index=0):
-        """Configure a channel for LLM communication"""
+                         downlink_enabled=True, uplink_enabled=True, index=0,
+                         legacy_psk_hash=False):
+        """
+        Configure a channel for LLM communication
+        
+        Text PSK seeds are hashed with BLAKE2b-128. Set legacy_psk_hash to derive
+        the key with truncated SHA-256 instead, matching channels created by
+        earlier versions of this script.
+        """
         if not self.interface:
             logger.error("Not connected to a Meshtastic device")
             return False
             
         try:
             # Get existing channels
-            channels = self.interface.getChannelByName(None)
+            channels = self._get_channels()
             
             # Check if the LLM channel already exists
             channel_exists = False
             for ch in channels:
                 if ch.settings.name == channel_name:
                     channel_exists = True
-                    logger.info(f"Channel '{channel_name}' already exists")
+                    logger.info("Channel '%s' already exists", channel_name)
                     break
                     
-            if not channel_exists:
-                logger.info(f"Creating channel '{channel_name}' with index {index}")
-                
-                # Create new channel settings
-                settings = meshtastic.Channel.ChannelSettings()
-                settings.name = channel_name
-                settings.modem_config = modem_config  # Long range, slow speed for maximum range
-                
-                # Set PSK if provided
-                if psk:
-                    if isinstance(psk, str):
-                        if len(psk) == 16:  # 16 byte hex string
-                            settings.psk = bytes.fromhex(psk)
-                        else:
-                            # Use the string as a seed for the PSK
-                            import hashlib
-                            h = hashlib.sha256()
-                            h.update(psk.encode())
-                            settings.psk = h.digest()[:16]  # Take first 16 bytes of hash
+            if channel_exists:
+                return True
+            
+            logger.info("Creating channel '%s' with index %s", channel_name, index)
+            
+            # Create new channel settings
+            settings = meshtastic.Channel.ChannelSettings()
+            settings.name = channel_name
+            settings.modem_config = modem_config  # Long range, slow speed for maximum range
+            
+            # Set PSK if provided
+            if psk:
+                if isinstance(psk, str):
+                    if len(psk) == 16:  # 16 byte hex string
+                        settings.psk = bytes.fromhex(psk)
+                    elif legacy_psk_hash:
+                        # Use the string as a seed for the PSK (first 16 bytes of SHA-256)
+                        settings.psk = hashlib.sha256(psk.encode()).digest()[:16]
                     else:
-                        # Assume it's already bytes
-                        settings.psk = psk
-                
-                # Configure role
-                role = meshtastic.Channel.Role()
-                role.uplink_enabled = uplink_enabled
-                role.downlink_enabled = downlink_enabled
-                
-                # Create the channel
-                self.interface.setChannel(index, settings, role)
-                logger.info(f"Channel '{channel_name}' created successfully")
-                
-                # Wait for a bit to allow the operation to complete
-                time.sleep(2)
-                
+                        # Use the string as a seed for the PSK
+                        settings.psk = hashlib.blake2b(psk.encode(), digest_size=16).digest()
+                else:
+                    # Assume it's already bytes
+                    settings.psk = psk
+            
+            # Configure role
+            role = meshtastic.Channel.Role()
+            role.uplink_enabled = uplink_enabled
+            role.downlink_enabled = downlink_enabled
+            
+            # Create the channel
+            self.interface.setChannel(index, settings, role)
+            self._invalidate_channels()
+            logger.info("Channel '%s' created successfully", channel_name)
+            
+            # Wait for a bit to allow the operation to complete
+            time.sleep(2)
+            
             # Verify channel was created
-            updated_channels = self.interface.getChannelByName(None)
+            updated_channels = self._get_channels()
             for ch in updated_channels:
                 if ch.settings.name == channel_name:
-                    logger.info(f"Channel verification successful: {ch.settings}")
+                    logger.info("Channel verification successful: %s", ch.settings)
                     return True
                     
-            if not channel_exists:
-                logger.error(f"Failed to verify channel '{channel_name}' creation")
-                return False
-                
-            return True
+            logger.error("Failed to verify channel '%s' creation", channel_name)
+            return False
                 
         except Exception as e:
-            logger.error(f"Error configuring channel: {str(e)}")
+            logger.error("Error configuring channel: %s", e)
             return False
             
+    def _get_channels(self):
+        """Get the device's channels, reading them from the device only once"""
+        if self._channel_cache is None:
+            self._channel_cache = self.interface.getChannelByName(None)
+        return self._channel_cache
+        
+    def _invalidate_channels(self):
+        """Forget cached channels after they have been changed on the device"""
+        self._channel_cache = None
+        
+    def _get_mqtt_config(self):
+        """Get the device's MQTT config, reading it from the device only once"""
+        if self._mqtt_config_cache is None:
+            self._mqtt_config_cache = self.interface.getConfig("mqtt")
+        return self._mqtt_config_cache
+            
     def save_configuration(self):
         """Save the current configuration to the device"""
         if not self.interface:
@@ -213,11 +237,13 @@ class MeshtasticConfigurator:
         try:
             logger.info("Saving configuration to device...")
             self.interface.writeConfig()
+            self._invalidate_channels()
+            self._mqtt_config_cache = None
             logger.info("Configuration saved successfully")
             self.config_applied = True
             return True
         except Exception as e:
-            logger.error(f"Error saving configuration: {str(e)}")
+            logger.error("Error saving configuration: %s", e)
             return False
             
     def print_device_info(self):
@@ -227,63 +253,50 @@ class MeshtasticConfigurator:
             return
             
         logger.info("\n=== Device Information ===")
-        logger.info(f"Node ID: {self.device_info.get('node_id', 'Unknown')}")
-        logger.info(f"Name: {self.device_info.get('long_name', 'Unknown')}")
-        logger.info(f"Hardware: {self.device_info.get('hardware_model', 'Unknown')}")
-        logger.info(f"Firmware: {self.device_info.get('firmware_version', 'Unknown')}")
+        logger.info("Node ID: %s", self.device_info.get('node_id', 'Unknown'))
+        logger.info("Name: %s", self.device_info.get('long_name', 'Unknown'))
+        logger.info("Hardware: %s", self.device_info.get('hardware_model', 'Unknown'))
+        logger.info("Firmware: %s", self.device_info.get('firmware_version', 'Unknown'))
         
         # Print MQTT settings
         if self.interface:
             try:
-                mqtt_config = self.interface.getConfig("mqtt")
+                mqtt_config = self._get_mqtt_config()
                 logger.info("\n=== MQTT Configuration ===")
-                logger.info(f"Server: {mqtt_config.get('address', 'Not set')}")
-                logger.info(f"Port: {mqtt_config.get('port', 1883)}")
-                logger.info(f"Enabled: {mqtt_config.get('enabled', False)}")
-                logger.info(f"Username: {mqtt_config.get('username', 'Not set')}")
-                logger.info(f"Password: {'*****' if mqtt_config.get('password') else 'Not set'}")
-                logger.info(f"Encryption: {mqtt_config.get('encryption_enabled', True)}")
+                logger.info("Server: %s", mqtt_config.get('address', 'Not set'))
+                logger.info("Port: %s", mqtt_config.get('port', 1883))
+                logger.info("Enabled: %s", mqtt_config.get('enabled', False))
+                logger.info("Username: %s", mqtt_config.get('username', 'Not set'))
+                logger.info("Password: %s", '*****' if mqtt_config.get('password') else 'Not set')
+                logger.info("Encryption: %s", mqtt_config.get('encryption_enabled', True))
                 
                 # Print channel information
-                channels = self.interface.getChannelByName(None)
+                channels = self._get_channels()
                 if channels:
                     logger.info("\n=== Channels ===")
                     for i, ch in enumerate(channels):
                         if hasattr(ch, 'settings') and hasattr(ch, 'role'):
-                            logger.info(f"Channel {i}: {ch.settings.name}")
-                            logger.info(f"  Modem Config: {ch.settings.modem_config}")
-                            logger.info(f"  PSK: {'Set' if ch.settings.psk else 'Not set'}")
-                            logger.info(f"  Uplink: {ch.role.uplink_enabled}")
-                            logger.info(f"  Downlink: {ch.role.downlink_enabled}")
+                            logger.info("Channel %s: %s", i, ch.settings.name)
+                            logger.info("  Modem Config: %s", ch.settings.modem_config)
+                            logger.info("  PSK: %s", 'Set' if ch.settings.psk else 'Not set')
+                            logger.info("  Uplink: %s", ch.role.uplink_enabled)
+                            logger.info("  Downlink: %s", ch.role.downlink_enabled)
             except Exception as e:
-                logger.error(f"Error retrieving config details: {str(e)}")
+                logger.error("Error retrieving config details: %s", e)
                 
     def reset_mqtt_config(self):
         """Reset the MQTT configuration to factory defaults"""
-        if not self.interface:
-            logger.error("Not connected to a Meshtastic device")
-            return False
-            
-        try:
-            logger.info("Resetting MQTT configuration to defaults...")
-            
-            # Empty MQTT configuration (disables MQTT)
-            mqtt_config = {
-                'address': '',
-                'username': '',
-                'password': '',
-                'enabled': False,
-                'port': 1883,
-                'encryption_enabled': True
-            }
-            
-            self.interface.setMQTT(**mqtt_config)
-            logger.info("MQTT configuration reset successfully")
-            return True
-                
-        except Exception as e:
-            logger.error(f"Error resetting MQTT configuration: {str(e)}")
-            return False
+        logger.info("Resetting MQTT configuration to defaults...")
+        
+        # Empty MQTT configuration (disables MQTT)
+        return self.configure_mqtt(
+            mqtt_server='',
+            mqtt_username='',
+            mqtt_password='',
+            mqtt_enabled=False,
+            mqtt_port=1883,
+            encryption_enabled=True
+        )
             
     def disconnect(self):
         """Disconnect from the device"""
@@ -329,6 +342,8 @@ def main():
                               help="Channel index (0-7)")
     channel_group.add_argument("--channel-psk", type=str,
                               help="Pre-shared key for the channel (16 byte hex string or text seed)")
+    channel_group.add_argument("--legacy-psk-hash", action="store_true",
+                              help="Derive the PSK from a text seed with SHA-256, as older versions did")
     channel_group.add_argument("--modem-config", type=int, default=9,
                               help="Modem config (0-13, higher is longer range but slower)")
     
@@ -397,7 +412,8 @@ def main():
             channel_name=args.channel_name,
             modem_config=args.modem_config,
             psk=args.channel_psk,
-            index=args.channel_index
+            index=args.channel_index,
+            legacy_psk_hash=args.legacy_psk_hash
         )
         
         # Save configuration to device
@@ -412,7 +428,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("Configuration interrupted by user")
     except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
+        logger.error("Unexpected error: %s", e)
         return 1
     finally:
         configurator.disconnect()
@@ -6,13 +6,13 @@ This script connects to a Meshtastic device via serial or IP and configures it t
 
 import sys
 import time
+import contextlib
 import logging
 import argparse
 import socket
 import meshtastic
 import meshtastic.serial_interface
 import meshtastic.tcp_interface
-from pubsub import pub
 
 # Setup logging
 logging.basicConfig(
@@ -21,9 +21,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def onConnection(interface, topic=pub.AUTO_TOPIC):
+# How long to wait for the device to report a config change before giving up
+CONFIG_APPLY_TIMEOUT = 2.0
+CONFIG_POLL_INTERVAL = 0.1
+
+def onConnection(interface):
     """Callback for when we connect to a Meshtastic device"""
-    logger.info(f"Connected to Meshtastic device: {interface.myInfo.my_node_num}")
+    logger.info("Connected to Meshtastic device: %s", interface.myInfo.my_node_num)
+
+def config_matches(current_config, mqtt_config):
+    """Check whether the device's MQTT config already has all the requested settings"""
+    return bool(current_config) and all(current_config.get(key) == value for key, value in mqtt_config.items())
+
+def set_low_latency(interface):
+    """Put the serial port in low-latency mode so request/response round-trips aren't held by the FTDI latency timer"""
+    stream = getattr(interface, 'stream', None)
+    # pyserial sets ASYNC_LOW_LATENCY via TIOCSSERIAL; only available on Linux
+    if stream is None or not hasattr(stream, 'set_low_latency_mode'):
+        return
+    try:
+        stream.set_low_latency_mode(True)
+        logger.info("Enabled low-latency mode on serial port")
+    except Exception as e:
+        logger.debug("Could not enable low-latency mode on serial port: %s", e)
+
+def get_local_ip():
+    """Get a non-loopback IPv4 address of this machine from the local interfaces, or None"""
+    try:
+        try:
+            import psutil
+            addresses = [
+                addr.address
+                for name, addrs in psutil.net_if_addrs().items() if not name.startswith('lo')
+                for addr in addrs if addr.family == socket.AF_INET
+            ]
+        except ImportError:
+            addresses = socket.gethostbyname_ex(socket.gethostname())[2]
+        
+        addresses = [address for address in addresses if not address.startswith('127.')]
+        return addresses[0] if addresses else None
+    except Exception:
+        return None
+
+def log_mqtt_config(mqtt_config):
+    """Log the MQTT settings read from the device"""
+    logger.info("  Server: %s", mqtt_config.get('address', 'Not set'))
+    logger.info("  Port: %s", mqtt_config.get('port', 'Not set'))
+    logger.info("  Username: %s", mqtt_config.get('username', 'Not set'))
+    logger.info("  Password: %s", 'Set' if mqtt_config.get('password') else 'Not set')
+    logger.info("  Encryption: %s", mqtt_config.get('encryption', False))
+    logger.info("  Enabled: %s", mqtt_config.get('enabled', False))
 
 def main():
     # Parse command line arguments
@@ -46,104 +93,93 @@ def main():
         return 1
     
     try:
-        # Subscribe to connection event
-        pub.subscribe(onConnection, "meshtastic.connection.established")
-        
-        # Connect to the device
-        if args.device:
-            logger.info(f"Connecting to Meshtastic device via serial: {args.device}")
-            interface = meshtastic.serial_interface.SerialInterface(args.device)
-        else:
-            logger.info(f"Connecting to Meshtastic device via TCP: {args.host}")
-            interface = meshtastic.tcp_interface.TCPInterface(args.host)
-        
-        # Wait for connection to establish
-        time.sleep(2)
+        with contextlib.ExitStack() as stack:
+            # Connect to the device
+            if args.device:
+                logger.info("Connecting to Meshtastic device via serial: %s", args.device)
+                interface = meshtastic.serial_interface.SerialInterface(args.device)
+                stack.callback(interface.close)
+                set_low_latency(interface)
+            else:
+                logger.info("Connecting to Meshtastic device via TCP: %s", args.host)
+                interface = meshtastic.tcp_interface.TCPInterface(args.host)
+                stack.callback(interface.close)
         
-        # Get current MQTT settings
-        logger.info("Current MQTT settings:")
-        mqtt_config = interface.getConfig("mqtt")
-        if mqtt_config:
-            logger.info(f"  Server: {mqtt_config.get('address', 'Not set')}")
-            logger.info(f"  Port: {mqtt_config.get('port', 'Not set')}")
-            logger.info(f"  Username: {mqtt_config.get('username', 'Not set')}")
-            logger.info(f"  Password: {'Set' if mqtt_config.get('password') else 'Not set'}")
-            logger.info(f"  Encryption: {mqtt_config.get('encryption', False)}")
-            logger.info(f"  Enabled: {mqtt_config.get('enabled', False)}")
-        else:
-            logger.info("  No MQTT configuration found")
+            # The interface constructor returns once the connection handshake is complete
+            onConnection(interface)
         
-        # Configure MQTT
-        logger.info(f"Setting MQTT server to: {args.mqtt_server}:{args.mqtt_port}")
+            # Get current MQTT settings
+            logger.info("Current MQTT settings:")
+            current_config = interface.getConfig("mqtt")
+            if current_config:
+                log_mqtt_config(current_config)
+            else:
+                logger.info("  No MQTT configuration found")
         
-        # Build MQTT configuration
-        mqtt_config = {
-            "address": args.mqtt_server,
-            "port": args.mqtt_port,
-            "enabled": True
-        }
+            # Configure MQTT
+            logger.info("Setting MQTT server to: %s:%s", args.mqtt_server, args.mqtt_port)
         
-        if args.mqtt_username:
-            mqtt_config["username"] = args.mqtt_username
-            logger.info(f"Setting MQTT username to: {args.mqtt_username}")
+            # Build MQTT configuration
+            mqtt_config = {
+                "address": args.mqtt_server,
+                "port": args.mqtt_port,
+                "enabled": True
+            }
         
-        if args.mqtt_password:
-            mqtt_config["password"] = args.mqtt_password
-            logger.info("Setting MQTT password")
+            if args.mqtt_username:
+                mqtt_config["username"] = args.mqtt_username
+                logger.info("Setting MQTT username to: %s", args.mqtt_username)
         
-        if args.mqtt_encryption:
-            mqtt_config["encryption"] = True
-            logger.info("Enabling MQTT encryption")
+            if args.mqtt_password:
+                mqtt_config["password"] = args.mqtt_password
+                logger.info("Setting MQTT password")
         
-        # Set the configuration
-        interface.setConfig("mqtt", mqtt_config)
-        logger.info("MQTT configuration sent to device")
+            if args.mqtt_encryption:
+                mqtt_config["encryption"] = True
+                logger.info("Enabling MQTT encryption")
         
-        # Wait for configuration to be applied
-        time.sleep(2)
+            if config_matches(current_config, mqtt_config):
+                # Nothing to change, and the read above already verifies the settings
+                logger.info("MQTT configuration already matches, not sending it again")
+                mqtt_config = current_config
+            else:
+                # Set the configuration
+                interface.setConfig("mqtt", mqtt_config)
+                logger.info("MQTT configuration sent to device")
+            
+                # Verify the configuration, re-reading until it has been applied
+                # (no longer than the old fixed delay)
+                deadline = time.monotonic() + CONFIG_APPLY_TIMEOUT
+                desired_config = mqtt_config
+                mqtt_config = interface.getConfig("mqtt")
+                while not config_matches(mqtt_config, desired_config) and time.monotonic() < deadline:
+                    time.sleep(CONFIG_POLL_INTERVAL)
+                    mqtt_config = interface.getConfig("mqtt")
         
-        # Verify the configuration
-        logger.info("Verifying MQTT configuration:")
-        mqtt_config = interface.getConfig("mqtt")
-        if mqtt_config:
-            logger.info(f"  Server: {mqtt_config.get('address', 'Not set')}")
-            logger.info(f"  Port: {mqtt_config.get('port', 'Not set')}")
-            logger.info(f"  Username: {mqtt_config.get('username', 'Not set')}")
-            logger.info(f"  Password: {'Set' if mqtt_config.get('password') else 'Not set'}")
-            logger.info(f"  Encryption: {mqtt_config.get('encryption', False)}")
-            logger.info(f"  Enabled: {mqtt_config.get('enabled', False)}")
+            logger.info("Verifying MQTT configuration:")
+            if mqtt_config:
+                log_mqtt_config(mqtt_config)
             
-            if mqtt_config.get('enabled', False):
-                logger.info("✅ MQTT is enabled on the device")
+                if mqtt_config.get('enabled', False):
+                    logger.info("✅ MQTT is enabled on the device")
+                else:
+                    logger.warning("⚠️ MQTT is not enabled on the device")
             else:
-                logger.warning("⚠️ MQTT is not enabled on the device")
-        else:
-            logger.error("❌ Failed to retrieve MQTT configuration")
+                logger.error("❌ Failed to retrieve MQTT configuration")
         
-        # Get the local IP address to help with configuration
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            local_ip = s.getsockname()[0]
-            s.close()
-            
-            logger.info(f"\nYour local IP address is: {local_ip}")
-            logger.info("Make sure your MQTT broker is running on this IP and accessible")
-            logger.info(f"The Meshtastic device will try to connect to: {args.mqtt_server}:{args.mqtt_port}")
-        except:
-            pass
+            # Get the local IP address to help with configuration
+            local_ip = get_local_ip()
+            if local_ip:
+                logger.info("\nYour local IP address is: %s", local_ip)
+                logger.info("Make sure your MQTT broker is running on this IP and accessible")
+                logger.info("The Meshtastic device will try to connect to: %s:%s", args.mqtt_server, args.mqtt_port)
         
-        logger.info("\nConfiguration complete. The device may need to be rebooted to apply changes.")
-        logger.info("To reboot the device, use: meshtastic --reboot")
+            logger.info("\nConfiguration complete. The device may need to be rebooted to apply changes.")
+            logger.info("To reboot the device, use: meshtastic --reboot")
         
     except Exception as e:
-        logger.error(f"Error configuring device: {str(e)}")
+        logger.error("Error configuring device: %s", e)
         return 1
-        
-    finally:
-        # Close the interface
-        if 'interface' in locals():
-            interface.close()
             
     return 0
 
@@ -5,6 +5,15 @@ import logging
 import requests
 import shutil
 from pathlib import Path
+
+# Use the Rust hf_transfer engine for downloads when it is installed.
+# This has to be set before huggingface_hub is imported.
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    pass
+
 from huggingface_hub import hf_hub_download
 
 # Setup logging
@@ -28,28 +37,33 @@ def download_gguf_model(model_id, filename, output_dir, output_filename=None):
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         
-        logger.info(f"Downloading {filename} from {model_id}")
+        logger.info("Downloading %s from %s", filename, model_id)
         
         # Download the model file
         temp_path = hf_hub_download(
             repo_id=model_id,
             filename=filename,
-            local_dir=output_dir,
-            local_dir_use_symlinks=False
+            local_dir=output_dir
         )
         
         # If output filename is specified, rename the file
         if output_filename:
             final_path = os.path.join(output_dir, output_filename)
-            shutil.copy2(temp_path, final_path)
-            logger.info(f"Model copied to {final_path}")
+            try:
+                os.replace(temp_path, final_path)
+                logger.info("Model moved to %s", final_path)
+            except OSError:
+                # Source and destination are on different filesystems
+                shutil.copy2(temp_path, final_path)
+                os.unlink(temp_path)
+                logger.info("Model copied to %s", final_path)
             return final_path
         else:
-            logger.info(f"Model downloaded successfully to {temp_path}")
+            logger.info("Model downloaded successfully to %s", temp_path)
             return temp_path
     
     except Exception as e:
-        logger.error(f"Error downloading model: {str(e)}")
+        logger.error("Error downloading model: %s", e)
         raise
 
 def main():
@@ -68,7 +82,7 @@ def main():
         download_gguf_model(args.model_id, args.filename, args.output_dir, args.output_filename)
         return 0
     except Exception as e:
-        logger.error(f"Download failed: {e}")
+        logger.error("Download failed: %s", e)
         return 1
 
 if __name__ == "__main__":
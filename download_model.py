@@ -1,34 +1,220 @@
 #!/usr/bin/env python3
 import os
+import re
+import hashlib
 import argparse
 import logging
+import shutil
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 from tqdm import tqdm
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from tqdm.utils import CallbackIOWrapper
+
+# Use the Rust hf_transfer engine for Hugging Face Hub downloads when it is installed.
+# This has to be set before huggingface_hub (or transformers) is imported.
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+    HF_TRANSFER_AVAILABLE = True
+except ImportError:
+    HF_TRANSFER_AVAILABLE = False
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def download_file(url, output_path):
+# Shared HTTP session so HEAD, GET and range requests reuse kept-alive connections
+MAX_CONNECTIONS = 16
+SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+def part_path_for(output_path):
+    """Path a download is written to until it is complete and verified"""
+    return output_path.with_name(output_path.name + '.part')
+
+def remove_partial(path):
+    """Delete an incomplete download, if it is still there"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def download_file(url, output_path, headers=None, session=None):
     """Download a file with progress bar"""
-    response = requests.get(url, stream=True)
+    session = session or SESSION
+    response = session.get(url, headers=headers, stream=True)
     response.raise_for_status()
     
     total_size = int(response.headers.get('content-length', 0))
-    block_size = 1024  # 1 Kibibyte
-    
-    with open(output_path, 'wb') as file, tqdm(
-            desc=output_path.name,
-            total=total_size,
-            unit='iB',
-            unit_scale=True,
-            unit_divisor=1024,
-    ) as bar:
-        for data in response.iter_content(block_size):
-            size = file.write(data)
-            bar.update(size)
+    logger.info("Total file size: %.2f MB", total_size / (1024 * 1024))
+    block_size = 1 << 20  # 1 Mebibyte
+    
+    # Let urllib3 undo any transfer encoding while we read straight from the socket
+    response.raw.decode_content = True
+    
+    # Only a complete, verified file is moved to output_path
+    part_path = part_path_for(output_path)
+    try:
+        with open(part_path, 'wb', buffering=4 << 20) as file, tqdm(
+                desc=output_path.name,
+                total=total_size,
+                unit='iB',
+                unit_scale=True,
+                unit_divisor=1024,
+        ) as bar:
+            # Reserve the whole file up front so the long write doesn't fragment it
+            if total_size and hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(file.fileno(), 0, total_size)
+                except OSError:
+                    pass
+            
+            # Copy in large blocks, updating the progress bar once per block
+            with response:
+                shutil.copyfileobj(response.raw, CallbackIOWrapper(bar.update, file, "write"), block_size)
+            
+            written = file.tell()
+            if total_size and written != total_size:
+                raise IOError(f"Incomplete download: got {written} of {total_size} bytes")
+        
+        verify_sha256(part_path, expected_sha256(response))
+    except BaseException:
+        remove_partial(part_path)
+        raise
+    
+    os.replace(part_path, output_path)
+    drop_from_page_cache(output_path)
+
+def expected_sha256(response):
+    """Get the SHA-256 that Hugging Face advertises for an LFS file, or None"""
+    # The hash is on the huggingface.co response, before any redirect to the CDN
+    for hop in [response, *response.history]:
+        etag = hop.headers.get('X-Linked-Etag', '').strip('"')
+        if etag.startswith('sha256:'):
+            etag = etag[len('sha256:'):]
+        if re.fullmatch(r'[0-9a-f]{64}', etag):
+            return etag
+    return None
+
+def verify_sha256(path, expected):
+    """Check a downloaded file against its expected SHA-256, deleting it on mismatch"""
+    if not expected:
+        logger.warning("No SHA-256 advertised for this file, skipping verification")
+        return
+    
+    logger.info("Verifying SHA-256 of downloaded file...")
+    with open(path, 'rb') as file:
+        if hasattr(hashlib, 'file_digest'):
+            digest = hashlib.file_digest(file, 'sha256').hexdigest()
+        else:
+            sha256 = hashlib.sha256()
+            for block in iter(lambda: file.read(1 << 20), b''):
+                sha256.update(block)
+            digest = sha256.hexdigest()
+    
+    if digest != expected:
+        os.unlink(path)
+        raise ValueError(f"SHA-256 mismatch for {path}: expected {expected}, got {digest}")
+    logger.info("SHA-256 verified")
+
+def drop_from_page_cache(path):
+    """Tell the kernel the downloaded file won't be read again soon, so it doesn't evict other cached pages"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def download_file_parallel(url, output_path, headers=None, connections=8, session=None):
+    """Download a file over several concurrent HTTP Range requests with progress bar"""
+    session = session or SESSION
+    headers = dict(headers or {})
+    block_size = 1 << 20  # 1 Mebibyte
+    connections = min(connections, MAX_CONNECTIONS)
+    
+    head = session.head(url, headers=headers, allow_redirects=True)
+    head.raise_for_status()
+    total_size = int(head.headers.get('content-length', 0))
+    
+    # Fall back to a single stream if asked to, or if the server can't serve byte ranges
+    if connections <= 1:
+        logger.info("Downloading with a single connection (--connections %s)", connections)
+        return download_file(url, output_path, headers=headers, session=session)
+    if not total_size:
+        logger.info("Server did not report the file size, downloading with a single connection")
+        return download_file(url, output_path, headers=headers, session=session)
+    if head.headers.get('accept-ranges', '').lower() != 'bytes':
+        logger.info("Server does not support range requests, downloading with a single connection")
+        return download_file(url, output_path, headers=headers, session=session)
+    
+    logger.info("Total file size: %.2f MB, using %s connections", total_size / (1024 * 1024), connections)
+    
+    # Split the file into one contiguous byte range per connection
+    part_size = -(-total_size // connections)
+    ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+    
+    # Only a complete, verified file is moved to output_path
+    part_path = part_path_for(output_path)
+    try:
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(fd, 0, total_size)
+                except OSError:
+                    os.ftruncate(fd, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+            
+            with tqdm(
+                    desc=output_path.name,
+                    total=total_size,
+                    unit='iB',
+                    unit_scale=True,
+                    unit_divisor=1024,
+            ) as bar:
+                bar_lock = threading.Lock()
+                
+                def fetch_range(byte_range):
+                    start, end = byte_range
+                    range_headers = dict(headers, Range=f"bytes={start}-{end}")
+                    with session.get(url, headers=range_headers, stream=True) as response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            raise RuntimeError(f"Server ignored range request for bytes {start}-{end}")
+                        
+                        offset = start
+                        for data in response.iter_content(block_size):
+                            os.pwrite(fd, data, offset)
+                            offset += len(data)
+                            with bar_lock:
+                                bar.update(len(data))
+                    
+                    if offset != end + 1:
+                        raise RuntimeError(f"Incomplete range bytes {start}-{end}: got {offset - start} bytes")
+                
+                with ThreadPoolExecutor(max_workers=connections) as executor:
+                    # list() re-raises the first error from any range
+                    list(executor.map(fetch_range, ranges))
+            
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        
+        verify_sha256(part_path, expected_sha256(head))
+    except BaseException:
+        remove_partial(part_path)
+        raise
+    
+    os.replace(part_path, output_path)
+    drop_from_page_cache(output_path)
 
 def main():
     parser = argparse.ArgumentParser(description="Download model from HuggingFace")
@@ -42,6 +228,11 @@ def main():
                         help="GGUF file name to download")
     parser.add_argument("--hf-token", type=str, default=None,
                         help="HuggingFace token for private repos")
+    parser.add_argument("--connections", type=int, default=8,
+                        help="Number of parallel connections for GGUF downloads (1 disables range requests)")
+    parser.add_argument("--hf-transfer", action="store_true",
+                        help="Download GGUF files through huggingface_hub with hf_transfer instead of the "
+                             "built-in range downloader (skips its SHA-256 check)")
     args = parser.parse_args()
     
     model_id = args.model
@@ -50,31 +241,45 @@ def main():
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    logger.info(f"Downloading model {model_id} to {output_dir}")
+    logger.info("Downloading model %s to %s", model_id, output_dir)
     
     try:
         if args.gguf:
             # Download GGUF model directly
-            logger.info(f"Downloading GGUF model file: {args.gguf_file}")
+            logger.info("Downloading GGUF model file: %s", args.gguf_file)
             output_path = Path(output_dir) / args.gguf_file
             
-            # Direct URL for a HuggingFace file
-            url = f"https://huggingface.co/{model_id}/resolve/main/{args.gguf_file}"
-            
-            # Include token if provided (for private repos)
-            headers = {}
-            if args.hf_token:
-                headers['Authorization'] = f"Bearer {args.hf_token}"
+            if args.hf_transfer and not HF_TRANSFER_AVAILABLE:
+                logger.warning("--hf-transfer given but hf_transfer is not installed (pip install hf_transfer), "
+                               "using the built-in downloader")
             
-            logger.info(f"Downloading from {url}")
-            response = requests.get(url, headers=headers, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            logger.info(f"Total file size: {total_size / (1024 * 1024):.2f} MB")
-            
-            download_file(url, output_path)
-            logger.info(f"GGUF model successfully downloaded to {output_path}")
+            if args.hf_transfer and HF_TRANSFER_AVAILABLE:
+                # hf_transfer already does parallel range downloads
+                from huggingface_hub import hf_hub_download
+                
+                logger.info("Downloading with hf_transfer")
+                output_path = hf_hub_download(
+                    repo_id=model_id,
+                    filename=args.gguf_file,
+                    local_dir=output_dir,
+                    token=args.hf_token
+                )
+            else:
+                # Direct URL for a HuggingFace file
+                url = f"https://huggingface.co/{model_id}/resolve/main/{args.gguf_file}"
+                
+                # Include token if provided (for private repos)
+                headers = {}
+                if args.hf_token:
+                    headers['Authorization'] = f"Bearer {args.hf_token}"
+                
+                logger.info("Downloading from %s", url)
+                download_file_parallel(url, output_path, headers=headers, connections=args.connections)
+            logger.info("GGUF model successfully downloaded to %s", output_path)
         else:
-            # Download using transformers
+            # Download using transformers (only imported here, GGUF downloads don't need it)
+            from transformers import AutoTokenizer, AutoModelForCausalLM
+            
             logger.info("Downloading tokenizer...")
             tokenizer = AutoTokenizer.from_pretrained(model_id)
             tokenizer.save_pretrained(os.path.join(output_dir, os.path.basename(model_id)))
@@ -83,10 +288,10 @@ def main():
             model = AutoModelForCausalLM.from_pretrained(model_id, trust_remote_code=True)
             model.save_pretrained(os.path.join(output_dir, os.path.basename(model_id)))
             
-            logger.info(f"Model and tokenizer successfully downloaded to {output_dir}")
+            logger.info("Model and tokenizer successfully downloaded to %s", output_dir)
         
     except Exception as e:
-        logger.error(f"Error downloading model: {str(e)}")
+        logger.error("Error downloading model: %s", e)
         return 1
     
     return 0
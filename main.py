@@ -2,37 +2,56 @@
 import os
 import sys
 import logging
+import logging.handlers
 import argparse
+import atexit
 import signal
-import time
-import torch
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from model_loader import ModelLoader
 from meshtastic_hybrid_client import MeshtasticHybridClient
-from agent import Agent
 import config
 
 # Setup logging
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# File records are buffered and written in batches (immediately for errors)
+# so logging doesn't add a write per record to message handling
+log_file = logging.handlers.RotatingFileHandler(
+    "lora_llm.log", maxBytes=50_000_000, backupCount=3, delay=True
+)
+log_file.setFormatter(logging.Formatter(LOG_FORMAT))
+log_file_handler = logging.handlers.MemoryHandler(
+    1024,
+    flushLevel=logging.ERROR,
+    target=log_file
+)
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=getattr(logging, os.environ.get("LORA_LOG_LEVEL", "INFO").upper(), logging.INFO),
+    format=LOG_FORMAT,
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler("lora_llm.log")
-    ]
+        log_file_handler
+    ],
+    # The client modules configure logging on import; replace their handlers
+    force=True
 )
+atexit.register(log_file_handler.flush)
 logger = logging.getLogger(__name__)
 
 # Global agent for signal handling
 agent = None
 
+# Set by the signal handler to wake the main thread for shutdown
+shutdown_event = threading.Event()
+
+# Shared pool for startup work that can run side by side (model load, connecting)
+POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="startup")
+
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully"""
     logger.info("Shutdown signal received")
-    if agent:
-        logger.info("Shutting down agent")
-        agent.shutdown()
-    sys.exit(0)
+    shutdown_event.set()
 
 def parse_args():
     parser = argparse.ArgumentParser(description="LLM Meshtastic Agent")
@@ -106,57 +125,88 @@ def main():
     if args.llm_response_channel:
         config.LLM_RESPONSE_CHANNEL = args.llm_response_channel
     
+    # Import the model stack only once we know we're going to run
+    # (torch/transformers take seconds to import)
+    import torch
+    from model_loader import ModelLoader
+    from agent import Agent
+    
     # Set device
     device = "cpu" if args.cpu_only else "cuda" if torch.cuda.is_available() else "cpu"
     
+    # Read the final configuration once
+    (model_id, use_gguf, mqtt_broker, mqtt_port, mqtt_username, mqtt_password,
+     use_llm_channel, llm_channel, llm_response_channel, tcp_host, tcp_port,
+     private_mode, send_startup_message) = (
+        config.MODEL_ID, config.USE_GGUF, config.MQTT_BROKER, config.MQTT_PORT,
+        config.MQTT_USERNAME, config.MQTT_PASSWORD, config.USE_LLM_CHANNEL,
+        config.LLM_CHANNEL, config.LLM_RESPONSE_CHANNEL, config.MESHTASTIC_IP,
+        config.MESHTASTIC_PORT, config.PRIVATE_MODE, config.SEND_STARTUP_MESSAGE)
+    
     # Print configuration
     logger.info("Starting LLM Meshtastic Agent with Hybrid Messaging")
-    logger.info(f"Model: {config.MODEL_ID}")
-    logger.info(f"MQTT Broker (for receiving): {config.MQTT_BROKER}")
-    logger.info(f"MQTT Port: {config.MQTT_PORT}")
-    logger.info(f"TCP Host (for sending): {config.MESHTASTIC_IP}")
-    logger.info(f"TCP Port: {config.MESHTASTIC_PORT}")
-    logger.info(f"Private Mode: {config.PRIVATE_MODE}")
-    logger.info(f"Device: {device}")
-    logger.info(f"Using GGUF: {config.USE_GGUF}")
-    logger.info(f"Send Startup Message: {config.SEND_STARTUP_MESSAGE}")
-    logger.info(f"Use LLM Channel: {config.USE_LLM_CHANNEL}")
-    logger.info(f"LLM Channel: {config.LLM_CHANNEL}")
-    logger.info(f"LLM Response Channel: {config.LLM_RESPONSE_CHANNEL}")
+    logger.info("Model: %s", model_id)
+    logger.info("MQTT Broker (for receiving): %s", mqtt_broker)
+    logger.info("MQTT Port: %s", mqtt_port)
+    logger.info("TCP Host (for sending): %s", tcp_host)
+    logger.info("TCP Port: %s", tcp_port)
+    logger.info("Private Mode: %s", private_mode)
+    logger.info("Device: %s", device)
+    logger.info("Using GGUF: %s", use_gguf)
+    logger.info("Send Startup Message: %s", send_startup_message)
+    logger.info("Use LLM Channel: %s", use_llm_channel)
+    logger.info("LLM Channel: %s", llm_channel)
+    logger.info("LLM Response Channel: %s", llm_response_channel)
     
     # Initialize model loader
     logger.info("Initializing model loader")
     model_loader = ModelLoader(
-        model_id=config.MODEL_ID,
+        model_id=model_id,
         local_path=config.MODEL_LOCAL_PATH,
-        use_gguf=config.USE_GGUF,
-        device=device
+        use_gguf=use_gguf,
+        device=device,
+        quant_format=config.QUANT_FORMAT,
+        backend=config.LLM_BACKEND
     )
     
-    # Load model
-    if not model_loader.load_model():
-        logger.error("Failed to load model")
-        return 1
+    # Warm the page cache with the model weights while loading
+    model_loader.preload()
+    
+    # Load model in the background while we connect to the Meshtastic interfaces
+    load_future = POOL.submit(model_loader.load_model)
     
     # Initialize Meshtastic Hybrid client
     logger.info("Initializing Meshtastic Hybrid client")
     meshtastic_client = MeshtasticHybridClient(
         # MQTT params (for receiving)
-        mqtt_broker=config.MQTT_BROKER,
-        mqtt_port=config.MQTT_PORT,
-        mqtt_username=config.MQTT_USERNAME,
-        mqtt_password=config.MQTT_PASSWORD,
-        use_llm_channel=config.USE_LLM_CHANNEL,
-        llm_channel=config.LLM_CHANNEL,
-        llm_response_channel=config.LLM_RESPONSE_CHANNEL,
+        mqtt_broker=mqtt_broker,
+        mqtt_port=mqtt_port,
+        mqtt_username=mqtt_username,
+        mqtt_password=mqtt_password,
+        use_llm_channel=use_llm_channel,
+        llm_channel=llm_channel,
+        llm_response_channel=llm_response_channel,
         # TCP params (for sending)
-        tcp_host=config.MESHTASTIC_IP,
-        tcp_port=config.MESHTASTIC_PORT,
+        tcp_host=tcp_host,
+        tcp_port=tcp_port,
         # Common params
-        private_mode=config.PRIVATE_MODE,
-        send_startup_message=config.SEND_STARTUP_MESSAGE
+        private_mode=private_mode,
+        # Announced below, once the agent is ready to answer
+        send_startup_message=False
     )
     
+    # Connect to both interfaces (messages that arrive before the agent is
+    # attached are ignored by the client)
+    connect_future = POOL.submit(meshtastic_client.connect)
+    
+    model_loaded = load_future.result()
+    model_loader.stop_preload()
+    if not model_loaded:
+        logger.error("Failed to load model")
+        if connect_future.result():
+            meshtastic_client.disconnect()
+        return 1
+    
     # Initialize agent
     logger.info("Initializing agent")
     global agent
@@ -164,17 +214,22 @@ def main():
         model_loader=model_loader,
         meshtastic_client=meshtastic_client,
         system_prompt=config.SYSTEM_PROMPT,
-        max_conversation_length=10
+        max_conversation_length=10,
+        batch_window_ms=config.BATCH_WINDOW_MS,
+        max_batch=config.MAX_BATCH_SIZE,
+        max_prompt_tokens=config.MAX_PROMPT_TOKENS
     )
     
     # Set message callback
     meshtastic_client.set_message_callback(agent.process_message)
     
-    # Connect to both interfaces
-    if not meshtastic_client.connect():
+    if not connect_future.result():
         logger.error("Failed to connect to Meshtastic interfaces")
         return 1
     
+    if send_startup_message:
+        meshtastic_client.send_startup_messages()
+    
     # Request node information
     logger.info("Requesting node information")
     meshtastic_client.request_node_info()
@@ -186,12 +241,14 @@ def main():
     # Run until interrupted
     try:
         logger.info("Agent is running. Press Ctrl+C to exit.")
-        while True:
-            time.sleep(1)
+        # Sleep until a signal arrives instead of waking up periodically
+        shutdown_event.wait()
     except KeyboardInterrupt:
         logger.info("Shutdown signal received")
-        if agent:
-            agent.shutdown()
+    
+    if agent:
+        logger.info("Shutting down agent")
+        agent.shutdown()
     
     return 0
 
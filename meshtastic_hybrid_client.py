@@ -1,17 +1,73 @@
 #!/usr/bin/env python3
 import logging
-import time
+import heapq
 import json
+import operator
+import queue
+import random
 import threading
-from typing import Dict, Any, Optional, Callable
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Tuple
 
-from meshtastic_mqtt_client import MeshtasticMqttClient
+from meshtastic_mqtt_client import MeshtasticMqttClient, RxMessage
 from meshtastic_tcp_client import MeshtasticTcpClient
 
+# Use orjson for encoding MQTT payloads when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Setup logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _dumps(obj) -> bytes:
+    """
+    Serialize obj to compact JSON bytes, ready to publish
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# Identical messages from the same sender within this many seconds are answered once
+DEDUP_TTL = 10.0
+DEDUP_CAPACITY = 128
+
+# Node number used for the LLM agent until the TCP client has learned the real one
+_PLACEHOLDER_NODE_NUM = 1234567890
+
+# Message fields needed to answer a message
+_MESSAGE_FIELDS = ('text', 'from_id', 'to_id', 'is_direct', 'is_llm_channel')
+_message_attrs = operator.attrgetter(*_MESSAGE_FIELDS)
+_message_fields = operator.itemgetter(*_MESSAGE_FIELDS)
+
+def _unpack_message(message):
+    """
+    Read the fields needed to answer a message in a single call
+    
+    Args:
+        message: RxMessage from the MQTT client, or a message dict
+        
+    Returns:
+        tuple: (text, from_id, to_id, is_direct, is_llm_channel)
+    """
+    if isinstance(message, RxMessage):
+        return _message_attrs(message)
+    
+    try:
+        return _message_fields(message)
+    except KeyError:
+        return (
+            message.get('text', ''),
+            message.get('from_id', 'unknown'),
+            message.get('to_id', 'broadcast'),
+            message.get('is_direct', False),
+            message.get('is_llm_channel', False)
+        )
+
 class MeshtasticHybridClient:
     """
     Hybrid client that receives messages via MQTT and sends responses via TCP
@@ -34,7 +90,9 @@ class MeshtasticHybridClient:
         tcp_port: int = 4403,
         # Common parameters
         private_mode: bool = False,
-        send_startup_message: bool = False
+        send_startup_message: bool = False,
+        send_queue_size: int = 256,
+        collect_window_ms: int = 25
     ):
         """
         Initialize the hybrid Meshtastic client
@@ -51,6 +109,10 @@ class MeshtasticHybridClient:
             tcp_port: TCP port for Meshtastic device
             private_mode: If True, only respond to direct messages
             send_startup_message: If True, send a startup message when connected
+            send_queue_size: Maximum number of responses waiting to be sent; the
+                oldest is dropped when the queue is full
+            collect_window_ms: How long the sender waits for more responses to the
+                same destination, to send them together as one message
         """
         self.private_mode = private_mode
         self.send_startup_message = send_startup_message
@@ -58,6 +120,12 @@ class MeshtasticHybridClient:
         self.llm_channel = llm_channel
         self.llm_response_channel = llm_response_channel
         
+        # Channel name for TCP sends: the last non-empty part of the response topic
+        self._llm_channel_name = next(
+            (part for part in reversed((llm_response_channel or '').split('/')) if part),
+            "llmres"
+        )
+        
         # Initialize MQTT client for receiving messages
         self.mqtt_client = MeshtasticMqttClient(
             broker=mqtt_broker,
@@ -81,48 +149,92 @@ class MeshtasticHybridClient:
         # Message handling
         self.message_callback = None
         self.connected = False
+        
+        # Where responses go, given the mode settings above
+        self._route_response = self._build_response_router()
+        
+        # Startup announcement, and its LLM channel payload encoded once
+        self._startup_message = self._build_startup_message()
+        self._startup_payload = json.dumps({
+            "from": _PLACEHOLDER_NODE_NUM,
+            "type": "sendtext",
+            "payload": {
+                "text": self._startup_message,
+                "from_id": "llm_agent",
+                "to_id": "broadcast"
+            }
+        }, separators=(',', ':'))
+        
+        # Our node's identity (placeholders until the TCP client has connected),
+        # and the fixed part of responses published to the LLM response channel
+        self._my_node_num = None
+        self._my_node_id_str = None
+        self._response_template = None
+        self._update_node_info()
+        
+        # Responses are sent from a worker thread so neither the MQTT network
+        # thread nor the callback's threads wait on TCP sends and retries
+        self._send_queue = queue.Queue(maxsize=send_queue_size)
+        self._sender_thread = None
+        self._collect_window = collect_window_ms / 1000.0
+        
+        # Recently handled (from_id, text hash) -> time, to skip messages the mesh re-delivers
+        self._recent_messages = OrderedDict()
+        self._recent_lock = threading.Lock()
+        
+        # Failed sends waiting to be retried, as (due time, sequence, item, attempt);
+        # only touched by the sender thread
+        self._retries = []
+        self._retry_seq = 0
+        
+        # Set on disconnect so pending retries are made right away instead of waiting
+        self._stop_event = threading.Event()
+        
+        # Moving average of TCP send success, used to retry less while the link is down
+        self._send_success_rate = 1.0
     
     def connect(self) -> bool:
         """
         Connect to both MQTT broker and Meshtastic TCP interface
         
         Returns:
-            bool: True if both connections are successful, False otherwise
+            bool: True if the MQTT broker is connected (TCP may still be down), False otherwise
         """
         logger.info("Connecting to MQTT and TCP interfaces...")
         
-        # Connect to MQTT broker first (for receiving)
-        mqtt_connected = self.mqtt_client.connect()
+        # Connect to the MQTT broker (for receiving) and the TCP interface (for
+        # sending, with retries) at the same time; they don't depend on each other
+        max_retries = 4  # Try up to 4 times to connect to TCP
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="connect") as executor:
+            mqtt_future = executor.submit(self.mqtt_client.connect)
+            tcp_future = executor.submit(self.tcp_client.connect, max_retries=max_retries)
+            mqtt_connected = mqtt_future.result()
+            tcp_connected = tcp_future.result()
+        
         if not mqtt_connected:
             logger.error("Failed to connect to MQTT broker")
+            self.tcp_client.disconnect()
             return False
         
-        # Connect to TCP interface (for sending) with retries
-        max_retries = 4  # Try up to 4 times to connect to TCP
-        tcp_connected = self.tcp_client.connect(max_retries=max_retries)
-        
-        if mqtt_connected and tcp_connected:
+        # MQTT is connected here; without TCP we keep running receive-only
+        self.connected = True
+        if tcp_connected:
             logger.info("Successfully connected to both MQTT and TCP interfaces")
-        elif mqtt_connected:
-            logger.warning("Connected to MQTT but failed to connect to TCP interface")
-        elif tcp_connected:
-            logger.warning("Connected to TCP but failed to connect to MQTT broker")
         else:
-            logger.error("Failed to connect to both MQTT and TCP interfaces")
-        
-        # Both connections successful
-        self.connected = mqtt_connected and tcp_connected
+            logger.warning("Connected to MQTT but failed to connect to TCP interface. "
+                           "Operating in MQTT-only mode (can receive messages but may not be able to send responses)")
         
-        # Allow operation even if only MQTT is connected, with warnings
-        if mqtt_connected and not tcp_connected:
-            logger.warning("Operating in MQTT-only mode (can receive messages but may not be able to send responses)")
-            self.connected = True  # Allow operation with just MQTT
+        # Responses are sent from the sender thread; the TCP client reconnects on demand
+        self._start_sender()
         
-        logger.info("Successfully connected to both MQTT and TCP interfaces")
+        self._update_node_info()
         
         # Override MQTT message callback with our own handler
         self.mqtt_client.set_message_callback(self._handle_mqtt_message)
         
+        # Received messages are processed on the MQTT client's worker thread
+        self.mqtt_client.start()
+        
         # Send startup message if enabled
         if self.send_startup_message:
             self.send_startup_messages()
@@ -135,8 +247,11 @@ class MeshtasticHybridClient:
         """
         logger.info("Disconnecting from MQTT and TCP interfaces...")
         
-        # Disconnect from MQTT
-        self.mqtt_client.disconnect()
+        # Let queued responses go out before closing the TCP connection
+        self._stop_sender()
+        
+        # Stop the MQTT worker thread and disconnect from MQTT
+        self.mqtt_client.stop()
         
         # Disconnect from TCP
         self.tcp_client.disconnect()
@@ -156,41 +271,236 @@ class MeshtasticHybridClient:
             
         Returns:
             None: We handle sending the response ourselves
+            
+        Exceptions from the callback propagate to the MQTT client, which logs them
+        with a traceback.
         """
         # Skip if no callback is set
         if not self.message_callback:
             logger.warning("No message callback set, ignoring message")
             return None
         
-        try:
-            # Extract message info
-            text = message.get('text', '')
-            from_id = message.get('from_id', 'unknown')
-            to_id = message.get('to_id', 'broadcast')
-            is_direct = message.get('is_direct', False)
-            is_llm_channel = message.get('is_llm_channel', False)
-            
-            logger.info(f"Processing message from {from_id}: {text[:50]}...")
+        # Extract message info
+        text, from_id, to_id, is_direct, is_llm_channel = _unpack_message(message)
+        
+        if self._is_duplicate(from_id, text):
+            logger.info("Ignoring duplicate message from %s: %.50s...", from_id, text)
+            return None
+        
+        logger.info("Processing message from %s: %.50s...", from_id, text)
+        
+        # Generate response using callback
+        response = self.message_callback(message)
+        
+        # Skip empty responses (the callback may send its response asynchronously)
+        if not response:
+            logger.info("No immediate response from callback")
+            return None
+        
+        logger.info("Generated response: %.50s...", response)
+        
+        # Send response through TCP client instead of MQTT
+        self._enqueue_response((response, from_id, to_id, is_direct, is_llm_channel))
+        
+        # Return None to prevent MQTT client from sending a response
+        return None
+    
+    def _is_duplicate(self, from_id: str, text: str) -> bool:
+        """
+        Check whether the same text from the same sender was handled recently
+        
+        Args:
+            from_id: Sender ID
+            text: Message text
             
-            # Generate response using callback
-            response = self.message_callback(message)
+        Returns:
+            bool: True if the message should be skipped
+        """
+        key = (from_id, hash(text))
+        now = time.monotonic()
+        with self._recent_lock:
+            seen = self._recent_messages.get(key)
+            if seen is not None and now - seen < DEDUP_TTL:
+                return True
             
-            # Skip empty responses
-            if not response:
-                logger.warning("Empty response from callback")
-                return None
+            self._recent_messages[key] = now
+            self._recent_messages.move_to_end(key)
+            if len(self._recent_messages) > DEDUP_CAPACITY:
+                self._recent_messages.popitem(last=False)
+        return False
+    
+    def _start_sender(self):
+        """
+        Start the response sender thread if it isn't running
+        """
+        if self._sender_thread and self._sender_thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._sender_thread = threading.Thread(target=self._sender_loop, name="tcp-sender")
+        self._sender_thread.daemon = True
+        self._sender_thread.start()
+    
+    def _stop_sender(self, timeout: float = 10.0):
+        """
+        Stop the response sender thread after it has sent the queued responses
+        
+        Args:
+            timeout: Maximum time in seconds to wait for the queue to drain
+        """
+        if not self._sender_thread or not self._sender_thread.is_alive():
+            return
+        
+        self._stop_event.set()
+        self._enqueue_response(None)
+        self._sender_thread.join(timeout=timeout)
+        self._sender_thread = None
+    
+    def _enqueue_response(self, item):
+        """
+        Queue a response for the sender thread, dropping the oldest one if full
+        
+        Args:
+            item: Arguments for _send_response_via_tcp, or None to stop the sender
+        """
+        while True:
+            try:
+                self._send_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._send_queue.get_nowait()
+                    logger.warning("Send queue full, dropping the oldest queued response")
+                except queue.Empty:
+                    pass
+    
+    def _sender_loop(self):
+        """
+        Send queued responses and due retries until stopped
+        
+        Retries wait in a heap ordered by due time instead of sleeping, so one
+        thread handles both and a failing send doesn't hold up the responses
+        queued behind it.
+        """
+        running = True
+        while running or self._retries:
+            self._send_due_retries()
+            if not running:
+                continue
             
-            logger.info(f"Generated response: {response[:50]}...")
+            try:
+                item = self._send_queue.get(timeout=self._time_to_next_retry())
+            except queue.Empty:
+                continue
+            if item is None:
+                running = False
+                continue
             
-            # Send response through TCP client instead of MQTT
-            self._send_response_via_tcp(response, from_id, to_id, is_direct, is_llm_channel)
+            # Gather whatever else arrives within the window
+            items = [item]
+            deadline = time.monotonic() + self._collect_window
+            while True:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._send_queue.get(timeout=remaining) if remaining > 0 else self._send_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                items.append(item)
             
-            # Return None to prevent MQTT client from sending a response
+            # Send everything gathered, plus any retries that came due, in one write
+            sends = [(item, 0) for item in self._coalesce_responses(items)]
+            sends.extend(self._pop_due_retries())
+            self._send_safely(sends)
+    
+    def _send_safely(self, sends):
+        """
+        Make a send attempt without letting an error stop the sender thread
+        
+        Args:
+            sends: (item, attempt) pairs for _send_responses_via_tcp
+        """
+        try:
+            self._send_responses_via_tcp(sends)
+        except (ConnectionError, OSError, TimeoutError) as e:
+            logger.error("Connection error in response sender thread: %s", e)
+        except Exception:
+            # Keep the sender alive, but don't hide programming errors
+            logger.exception("Unexpected error in response sender thread")
+    
+    def _schedule_retry(self, item, attempt: int, delay: float):
+        """
+        Schedule another attempt at sending a response
+        
+        Args:
+            item: Arguments for _send_response_via_tcp
+            attempt: Number of attempts made so far
+            delay: Seconds to wait before retrying
+        """
+        self._retry_seq += 1
+        heapq.heappush(self._retries, (time.monotonic() + delay, self._retry_seq, item, attempt))
+    
+    def _time_to_next_retry(self) -> Optional[float]:
+        """
+        Seconds until the next retry is due, or None if there are none
+        """
+        if not self._retries:
             return None
+        return max(self._retries[0][0] - time.monotonic(), 0.0)
+    
+    def _pop_due_retries(self) -> List[Tuple[tuple, int]]:
+        """
+        Take the retries that are due (all of them once stopping) off the heap
+        
+        Returns:
+            list: (item, attempt) pairs
+        """
+        stopping = self._stop_event.is_set()
+        due = []
+        while self._retries and (stopping or self._retries[0][0] <= time.monotonic()):
+            _, _, item, attempt = heapq.heappop(self._retries)
+            due.append((item, attempt))
+        return due
+    
+    def _send_due_retries(self):
+        """
+        Make the retries that are due, together in one write
+        """
+        due = self._pop_due_retries()
+        if due:
+            self._send_safely(due)
+    
+    def _coalesce_responses(self, items):
+        """
+        Join responses that go to the same destination into one message each
+        
+        Args:
+            items: Queued _send_response_via_tcp arguments, oldest first
             
-        except Exception as e:
-            logger.error(f"Error handling MQTT message: {str(e)}")
-            return None
+        Returns:
+            list: Arguments for _send_response_via_tcp, one per destination
+        """
+        if len(items) == 1:
+            return items
+        
+        groups = {}
+        for item in items:
+            response, from_id, to_id, is_direct, is_llm_channel = item
+            key = self._route_response(from_id, is_direct, is_llm_channel)
+            if key in groups:
+                groups[key][1].append(response)
+            else:
+                groups[key] = (item, [response])
+        
+        if len(groups) < len(items):
+            logger.info("Coalesced %d responses into %d messages", len(items), len(groups))
+        
+        return [
+            (item if len(responses) == 1 else ("\n".join(responses),) + item[1:])
+            for item, responses in groups.values()
+        ]
     
     def _send_response_via_tcp(
         self, 
@@ -198,10 +508,11 @@ class MeshtasticHybridClient:
         from_id: str, 
         to_id: str,
         is_direct: bool,
-        is_llm_channel: bool
-    ):
+        is_llm_channel: bool,
+        attempt: int = 0
+    ) -> bool:
         """
-        Send response via TCP client
+        Make one attempt at sending a response via TCP
         
         Args:
             response: Response text
@@ -209,70 +520,140 @@ class MeshtasticHybridClient:
             to_id: Original recipient ID
             is_direct: Whether the original message was direct
             is_llm_channel: Whether the original message was from LLM channel
+            attempt: Number of earlier attempts for this response
+            
+        Returns:
+            bool: True if the reply was sent
         """
-        max_retries = 2
-        for attempt in range(max_retries + 1):
-            try:
-                # Determine if this should be a direct message
-                # In private mode or if original message was direct, respond directly
-                if self.private_mode or is_direct:
-                    logger.info(f"Sending direct TCP response to {from_id}")
-                    success = self.tcp_client.send_message(response, from_id)
+        return self._send_responses_via_tcp(
+            [((response, from_id, to_id, is_direct, is_llm_channel), attempt)]
+        )[0]
+    
+    def _send_responses_via_tcp(self, sends: List[Tuple[tuple, int]]) -> List[bool]:
+        """
+        Make one attempt at sending several responses via TCP, in a single write
+        
+        A response's first attempt also sends its LLM response channel copy. Failed
+        replies are scheduled for a retry with exponential backoff. Only called
+        from the sender thread.
+        
+        Args:
+            sends: (item, attempt) pairs, where item is (response, from_id, to_id,
+                is_direct, is_llm_channel) and attempt the number of earlier attempts
+            
+        Returns:
+            List[bool]: Whether each reply was sent
+        """
+        batch = []
+        # Position of each response's reply, and of its channel copy (or None), in the batch
+        positions = []
+        for (response, from_id, to_id, is_direct, is_llm_channel), attempt in sends:
+            target, channel_name = self._route_response(from_id, is_direct, is_llm_channel)
+            if target is not None:
+                logger.info("Sending direct TCP response to %s", target)
+            else:
+                logger.info("Sending broadcast TCP response")
+            reply_index = len(batch)
+            batch.append((response, target, None))
+            
+            # Also send to LLM response channel if this was an LLM channel message
+            # (only once; retries are for the reply)
+            channel_index = None
+            if attempt == 0 and channel_name is not None:
+                logger.info("Sending response to LLM response channel via TCP: %s", channel_name)
+                channel_index = len(batch)
+                batch.append((response, None, channel_name))
+            positions.append((reply_index, channel_index))
+        
+        try:
+            results = self.tcp_client.send_batch(batch)
+        except Exception as e:
+            logger.error("Error sending responses: %s", e)
+            results = [False] * len(batch)
+        
+        # Don't keep retrying every response while most sends are failing
+        max_retries = 2 if self._send_success_rate >= 0.5 else 1
+        replies_sent = []
+        for (item, attempt), (reply_index, channel_index) in zip(sends, positions):
+            response, from_id = item[0], item[1]
+            
+            if channel_index is not None:
+                if results[channel_index]:
+                    logger.info("Successfully sent response to LLM channel: %.50s...", response)
                 else:
-                    logger.info("Sending broadcast TCP response")
-                    success = self.tcp_client.send_message(response)
+                    logger.error("Failed to send response to LLM channel, falling back to MQTT")
                     
-                if success:
-                    logger.info(f"TCP response sent successfully: {response[:50]}...")
-                elif attempt < max_retries:
-                    logger.warning(f"Failed to send TCP response, retrying (attempt {attempt+1}/{max_retries})...")
-                    continue
-                else:
-                    logger.error("Failed to send TCP response after all retries")
-                
-                # Also send to LLM response channel if this was an LLM channel message
-                if is_llm_channel and self.use_llm_channel:
-                    # Extract channel name from the full path
-                    if self.llm_response_channel:
-                        # Get the actual channel name (usually the last non-empty part)
-                        llm_channel_parts = self.llm_response_channel.split('/')
-                        # Filter out empty parts and get the last meaningful part (usually the channel name)
-                        non_empty_parts = [part for part in llm_channel_parts if part]
-                        if non_empty_parts:
-                            channel_name = non_empty_parts[-1]  # Take the last non-empty part
-                        else:
-                            channel_name = "llmres"  # Default fallback
-                        
-                        logger.info(f"Sending response to LLM response channel via TCP: {channel_name}")
-                        
-                        # Use the TCP client to send to the specific channel
-                        channel_success = self.tcp_client.send_to_channel(response, channel_name)
-                        
-                        if channel_success:
-                            logger.info(f"Successfully sent response to LLM channel: {response[:50]}...")
-                            # We're done if both sends succeeded
-                            return
-                        else:
-                            logger.error(f"Failed to send response to LLM channel, falling back to MQTT")
-                            
-                            # Fallback to MQTT if TCP channel send failed
-                            self._send_response_via_mqtt_llm_channel(response, from_id)
-                    else:
-                        logger.warning("LLM response channel not configured")
-                
-                # If we got here, we either succeeded or exhausted all retries
-                return
-                
-            except Exception as e:
-                logger.error(f"Error sending response (attempt {attempt+1}/{max_retries}): {str(e)}")
-                if attempt < max_retries:
-                    logger.info(f"Retrying in 2 seconds...")
-                    time.sleep(2)
-                else:
-                    # Try MQTT as last resort
-                    logger.error("Exhausted all TCP retries, falling back to MQTT")
-                    if is_llm_channel and self.use_llm_channel:
-                        self._send_response_via_mqtt_llm_channel(response, from_id)
+                    # Fallback to MQTT if TCP channel send failed
+                    self._send_response_via_mqtt_llm_channel(response, from_id)
+            
+            sent = results[reply_index]
+            replies_sent.append(sent)
+            if sent:
+                logger.info("TCP response sent successfully: %.50s...", response)
+            elif attempt < max_retries:
+                # Short exponential backoff with jitter
+                delay = min(0.1 * (2 ** attempt) + random.uniform(0, 0.05), 1.0)
+                logger.warning("Failed to send TCP response, retrying in %.2f seconds (attempt %s/%s)...", delay, attempt+1, max_retries)
+                self._schedule_retry(item, attempt + 1, delay)
+                continue
+            else:
+                logger.error("Failed to send TCP response after all retries")
+            
+            self._send_success_rate = 0.9 * self._send_success_rate + 0.1 * sent
+        
+        return replies_sent
+    
+    def _build_response_router(self):
+        """
+        Build the function that decides where a response goes
+        
+        private_mode and the LLM channel settings don't change per message, so
+        they are resolved here once instead of being checked for every response.
+        
+        Returns:
+            Callable: (from_id, is_direct, is_llm_channel) -> (to_id, channel_name),
+                where to_id is None for a broadcast reply and channel_name is the
+                LLM response channel to copy the reply to, or None
+        """
+        channel_name = None
+        if self.use_llm_channel:
+            if self.llm_response_channel:
+                channel_name = self._llm_channel_name
+            else:
+                logger.warning("LLM response channel not configured")
+        
+        if self.private_mode:
+            # In private mode, always respond directly
+            if channel_name is None:
+                def route(from_id, is_direct, is_llm_channel):
+                    return from_id, None
+            else:
+                def route(from_id, is_direct, is_llm_channel):
+                    return from_id, channel_name if is_llm_channel else None
+        else:
+            # Respond directly only if the original message was direct
+            if channel_name is None:
+                def route(from_id, is_direct, is_llm_channel):
+                    return from_id if is_direct else None, None
+            else:
+                def route(from_id, is_direct, is_llm_channel):
+                    return from_id if is_direct else None, channel_name if is_llm_channel else None
+        
+        return route
+    
+    def send_response(self, response: str, message: Dict[str, Any]):
+        """
+        Queue a response to a previously received message for sending via TCP
+        
+        Used by callbacks that generate their response asynchronously instead
+        of returning it from the message callback.
+        
+        Args:
+            response: Response text
+            message: Message dict the response answers
+        """
+        _, from_id, to_id, is_direct, is_llm_channel = _unpack_message(message)
+        self._enqueue_response((response, from_id, to_id, is_direct, is_llm_channel))
     
     def _send_response_via_mqtt_llm_channel(self, response, from_id):
         """
@@ -283,26 +664,38 @@ class MeshtasticHybridClient:
             from_id: Original sender ID
         """
         try:
+            # TCP may have (re)connected since startup, e.g. through a send retry
+            if self._my_node_num == _PLACEHOLDER_NODE_NUM:
+                self._update_node_info()
+            
             # Format as JSON for LLM channel
-            response_data = {
-                "from": self.tcp_client.my_node_id_num if hasattr(self.tcp_client, 'my_node_id_num') else 1234567890,
-                "type": "sendtext",
-                "payload": {
-                    "text": response,
-                    "from_id": self.tcp_client.my_node_id if hasattr(self.tcp_client, 'my_node_id') else "llm_agent",
-                    "to_id": from_id if self.private_mode else "broadcast",
-                    "is_response": True
-                }
+            response_data = self._response_template.copy()
+            response_data["payload"] = {
+                "text": response,
+                "from_id": self._my_node_id_str,
+                "to_id": from_id if self.private_mode else "broadcast",
+                "is_response": True
             }
             
-            # Use MQTT client as fallback
-            success = self.mqtt_client.publish_to_llm_response_channel(response_data)
+            # Use MQTT client as fallback (non-dict data is published as-is)
+            success = self.mqtt_client.publish_to_llm_response_channel(_dumps(response_data), qos=0)
             if success:
-                logger.info(f"Successfully published response to LLM response channel via MQTT")
+                logger.info("Successfully published response to LLM response channel via MQTT")
             else:
-                logger.error(f"Failed to publish response to LLM response channel via MQTT")
+                logger.error("Failed to publish response to LLM response channel via MQTT")
         except Exception as e:
-            logger.error(f"Error publishing to LLM response channel: {str(e)}")
+            logger.error("Error publishing to LLM response channel: %s", e)
+    
+    def _update_node_info(self):
+        """
+        Cache our node's number and ID from the TCP client, e.g. after connecting
+        """
+        self._my_node_num = getattr(self.tcp_client, 'my_node_num', None) or _PLACEHOLDER_NODE_NUM
+        self._my_node_id_str = getattr(self.tcp_client, 'my_node_id', None) or "llm_agent"
+        self._response_template = {
+            "from": self._my_node_num,
+            "type": "sendtext"
+        }
     
     def set_message_callback(self, callback: Callable[[Dict[str, Any]], Optional[str]]):
         """
@@ -320,35 +713,32 @@ class MeshtasticHybridClient:
         self.mqtt_client.request_node_info()
         # TCP client automatically gets node info on connect
     
-    def send_startup_messages(self):
+    def _build_startup_message(self) -> str:
         """
-        Send startup messages on both interfaces
+        Build the startup announcement for the configured mode
         """
         startup_message = "📢 LLM Agent is now online and ready for conversations!"
         if self.private_mode:
             startup_message += " (Private mode: only responding to direct messages)"
         if self.use_llm_channel:
             startup_message += f" (Listening on channel: {self.llm_channel})"
+        return startup_message
+    
+    def send_startup_messages(self):
+        """
+        Send startup messages on both interfaces
+        """
+        startup_message = self._startup_message
         
         # Send via TCP
         self.tcp_client.send_message(startup_message)
-        logger.info(f"Sent startup message via TCP: {startup_message}")
+        logger.info("Sent startup message via TCP: %s", startup_message)
         
         # Also send to LLM channel if enabled
         if self.use_llm_channel:
-            # Format as JSON for LLM channel
-            startup_data = {
-                "from": 1234567890,  # Placeholder ID for LLM agent
-                "type": "sendtext",
-                "payload": {
-                    "text": startup_message,
-                    "from_id": "llm_agent",
-                    "to_id": "broadcast"
-                }
-            }
             # Still use MQTT to publish to the LLM channel, as TCP can't publish there
-            self.mqtt_client.send_to_llm_channel(startup_data)
-            logger.info(f"Sent startup message to LLM channel: {startup_message}")
+            self.mqtt_client.send_to_llm_channel(self._startup_payload)
+            logger.info("Sent startup message to LLM channel: %s", startup_message)
     
     def send_message(self, text: str, to_id: str = None) -> bool:
         """
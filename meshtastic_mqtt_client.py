@@ -1,21 +1,190 @@
 #!/usr/bin/env python3
 import logging
+import socket
 import time
 import json
 import threading
-import queue
-from typing import Dict, Any, List, Optional, Callable
-import traceback
+from collections import deque
+from typing import Dict, Any, List, Optional, Callable, Tuple
 
 import paho.mqtt.client as mqtt
 
+# Parse and serialize MQTT payloads with orjson when it is installed
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _json_decode = json.JSONDecoder().decode
+    _json_encode = json.JSONEncoder(separators=(',', ':')).encode
+    
+    def _loads(payload: bytes) -> Any:
+        """
+        Parse a UTF-8 JSON payload with a shared decoder
+        """
+        return _json_decode(payload.decode('utf-8'))
+    
+    def _dumps(obj) -> bytes:
+        """
+        Serialize obj to compact JSON bytes with a shared encoder
+        """
+        return _json_encode(obj).encode('utf-8')
+
 # Setup logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Socket buffer size for the broker connection, so bursts of inbound messages
+# are read in fewer recv() calls
+SOCKET_BUFFER_SIZE = 256 * 1024
+# QoS 1/2 publishes allowed in flight before paho starts queueing them (paho's default is 20)
+MAX_INFLIGHT_MESSAGES = 100
+
+# Fields probed, in order, for the text and sender of a generic JSON message
+_TEXT_KEYS = ('text', 'message', 'content', 'body')
+_SENDER_KEYS = ('from', 'from_id', 'sender', 'user', 'userId')
+
+# Destination IDs that mean "everyone" in native Meshtastic messages
+_BROADCAST_IDS = ('broadcast', '4294967295')
+
+def _sender_of(data: Dict[str, Any]) -> str:
+    """
+    Sender of a message that carries it in a top-level 'sender' or 'from' field
+    """
+    return data.get('sender') or str(data.get('from', ''))
+
+def _sender_from_topic(topic: str) -> str:
+    """
+    Node ID at the end of a topic (e.g. msh/.../!abcd1234), or "unknown"
+    """
+    last_part = topic.rsplit('/', 1)[-1]
+    return last_part if last_part.startswith('!') else "unknown"
+
+def _extract_native_text(data, p):
+    """
+    Meshtastic native 'text' type message: {"type": "text", "from": ..., "to": ..., "payload": {"text": ...}}
+    """
+    to_id = str(data.get('to', 'broadcast'))
+    return p.get('text', ''), _sender_of(data), to_id, to_id not in _BROADCAST_IDS
+
+def _extract_sendtext(data, p):
+    """
+    Our custom 'sendtext' format: {"type": "sendtext", "payload": {"text": ..., "from_id": ..., "to_id": ...}}
+    """
+    return p.get('text', ''), p.get('from_id') or str(data.get('from', '')), p.get('to_id'), True
+
+def _extract_payload_text(data, p):
+    """
+    Any JSON with a payload containing text field
+    """
+    return p['text'], _sender_of(data), str(data.get('to', 'broadcast')), True
+
+def _extract_direct_text(data, p):
+    """
+    Direct text field: {"text": ..., "from_id"/"sender": ..., "to_id"/"to": ...}
+    """
+    return (data.get('text', ''), data.get('from_id') or data.get('sender', 'unknown'),
+            data.get('to_id') or data.get('to', 'broadcast'), True)
+
+# Extractors take (data, payload), where payload is data['payload'] if that is a dict,
+# otherwise None, and return (text, from_id, to_id, is_direct).
+
+# Typed messages with a payload dict, looked up by their 'type' field
+_SHAPE_BY_TYPE = {
+    'text': (_extract_native_text, "native Meshtastic text message"),
+    'sendtext': (_extract_sendtext, "custom sendtext message"),
+}
+
+# Untyped shapes, tried in order, as (matches, extract, label)
+_JSON_SHAPES = (
+    (lambda data, p: p is not None and 'text' in p, _extract_payload_text,
+     "JSON message with text payload"),
+    (lambda data, p: 'text' in data, _extract_direct_text,
+     "JSON with direct text field"),
+)
+
+class RxMessage:
+    """
+    A text message received over MQTT
+    
+    Fields are stored in slots rather than a dict. get(), [] and "in" work as they
+    did on the message dicts this replaces, so existing callbacks keep working;
+    as_dict() returns a plain dict for code that needs one.
+    
+    Instances are not pooled or reused: message callbacks (the agent queues them
+    for its worker threads) may hold on to a message after _process_message returns.
+    """
+    
+    __slots__ = (
+        "text", "from_id", "to_id", "sender", "timestamp",
+        "is_direct", "is_llm_channel", "channel", "packet_id"
+    )
+    
+    def __init__(
+        self,
+        text: str,
+        from_id: str,
+        to_id: str,
+        sender: str,
+        timestamp: float,
+        is_direct: bool,
+        is_llm_channel: bool,
+        channel: Optional[int] = None,
+        packet_id: Optional[Any] = None
+    ):
+        self.text = text
+        self.from_id = from_id
+        self.to_id = to_id
+        self.sender = sender
+        self.timestamp = timestamp
+        self.is_direct = is_direct
+        self.is_llm_channel = is_llm_channel
+        # Only regular channel messages carry these; leave them unset otherwise
+        # so get() falls back to its default like a missing dict key
+        if channel is not None:
+            self.channel = channel
+        if packet_id is not None:
+            self.packet_id = packet_id
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key, default)
+    
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and hasattr(self, key)
+    
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Return the message as a plain dict
+        """
+        return {key: getattr(self, key) for key in self.__slots__ if hasattr(self, key)}
+    
+    def __repr__(self):
+        return f"RxMessage({self.as_dict()!r})"
+
 class MeshtasticMqttClient:
     """Client for interacting with Meshtastic over MQTT"""
     
+    # Prefix of our own startup broadcast, ignored when it echoes back
+    _STARTUP_ECHO = "📢 LLM Agent is now online"
+    # Name our node announces itself with and the sender ID of our replies
+    _SELF_ID = "llm_agent"
+    # LLM response channel message with the text and destination left to fill in;
+    # 1234567890 is a placeholder node number for the LLM agent
+    _SENDTEXT_TEMPLATE = (
+        b'{"from":1234567890,"type":"sendtext","payload":{"text":%s,"from_id":"'
+        + _SELF_ID.encode() + b'","to_id":%s}}'
+    )
+    
     def __init__(
         self,
         broker: str,
@@ -26,7 +195,9 @@ class MeshtasticMqttClient:
         send_startup_message: bool = False,
         use_llm_channel: bool = False,
         llm_channel: str = None,
-        llm_response_channel: str = None
+        llm_response_channel: str = None,
+        broadcast_qos: int = 0,
+        llm_channel_qos: int = 1
     ):
         """
         Initialize the Meshtastic MQTT client
@@ -41,6 +212,12 @@ class MeshtasticMqttClient:
             use_llm_channel: If True, use a dedicated LLM channel
             llm_channel: MQTT topic for LLM channel
             llm_response_channel: MQTT topic for LLM response channel
+            broadcast_qos: MQTT QoS for broadcast messages. Defaults to 0: broadcast
+                chatter is best-effort over the mesh anyway, and skipping the PUBACK
+                round-trip keeps the broker fast. Direct messages always use QoS 1.
+            llm_channel_qos: MQTT QoS for send_to_llm_channel. Set it to 0 on a LAN
+                broker to publish back-to-back without waiting for each PUBACK, at the
+                cost of losing a message if the connection drops mid-send.
         """
         self.broker = broker
         self.port = port
@@ -50,13 +227,18 @@ class MeshtasticMqttClient:
         self.send_startup_message = send_startup_message
         self.use_llm_channel = use_llm_channel
         self.llm_channel = llm_channel
+        self._user_topics = {}  # to_id -> user-specific response topic
         self.llm_response_channel = llm_response_channel
+        self.broadcast_qos = broadcast_qos
+        self.llm_channel_qos = llm_channel_qos
         
         # Connection status
         self.connected = False
+        self._connected_event = threading.Event()  # Set once the broker answers a connect
         
         # Message handling
-        self.message_queue = queue.Queue()
+        self.message_queue = deque()  # one producer (paho thread), one consumer
+        self._msg_event = threading.Event()
         self.message_callback = None
         self.running = False
         self.message_thread = None
@@ -67,10 +249,100 @@ class MeshtasticMqttClient:
         self.tx_topic = f"{self.base_topic}/broadcast/txt"  # Send broadcast messages
         self.nodeinfo_topic_prefix = f"{self.base_topic}/+/nodeinfo"  # Node information
         
+        # The subscriptions above use a "+" wildcard, so incoming topics are
+        # matched on the fixed parts (msh/<node>/rx) rather than as a literal prefix
+        self._topic_prefix = f"{self.base_topic}/"
+        self._rx_suffix = "/rx"
+        self._nodeinfo_suffix = "/nodeinfo"
+        # The LLM channel matches itself and its subtopics, but not siblings that
+        # merely share the prefix (".../llm" must not match ".../llmres")
+        self._llm_channel_prefix = self.llm_channel.rstrip('/') if self.llm_channel else None
+        self._llm_channel_subtopics = f"{self._llm_channel_prefix}/" if self._llm_channel_prefix else None
+        
         # Node info
+        self._direct_topics = {}  # to_id -> direct message topic via our node
+        self._addressed_prefixes = {}  # to_id -> JSON prefix of an addressed broadcast
         self.my_node_id = None
         self.nodes = {}
         
+    @property
+    def llm_response_channel(self) -> Optional[str]:
+        """
+        MQTT topic for LLM responses
+        """
+        return self._llm_response_channel
+    
+    @llm_response_channel.setter
+    def llm_response_channel(self, channel: Optional[str]):
+        self._llm_response_channel = channel
+        # User-specific topics hang off the response channel; rebuild them on change
+        if channel:
+            self._user_topic_prefix = channel if channel.endswith('/') else f"{channel}/"
+        else:
+            self._user_topic_prefix = None
+        self._user_topics.clear()
+    
+    @property
+    def my_node_id(self):
+        """
+        Our node's ID, once identified from its node info
+        """
+        return self._my_node_id
+    
+    @my_node_id.setter
+    def my_node_id(self, node_id):
+        self._my_node_id = node_id
+        # Direct message topics go through our node; rebuild them on change
+        self._direct_topic_template = f"{self.base_topic}/{node_id}/c/%s/txt"
+        self._direct_topics.clear()
+    
+    def _direct_topic(self, to_id: str) -> str:
+        """
+        Get the topic for a direct message to a node, sent via our node's txt topic
+        
+        Args:
+            to_id: Node ID to send to
+            
+        Returns:
+            str: Topic to publish to
+        """
+        topic = self._direct_topics.get(to_id)
+        if topic is None:
+            topic = self._direct_topics[to_id] = self._direct_topic_template % to_id
+        return topic
+    
+    def _addressed_broadcast_payload(self, text: str, to_id: str) -> bytes:
+        """
+        Build a broadcast payload carrying a 'to' field, for when our node ID is unknown
+        
+        Args:
+            text: Text message to send
+            to_id: Node ID the message is for
+            
+        Returns:
+            bytes: JSON payload {"to": to_id, "text": text}
+        """
+        prefix = self._addressed_prefixes.get(to_id)
+        if prefix is None:
+            prefix = self._addressed_prefixes[to_id] = b'{"to":' + _dumps(to_id) + b',"text":'
+        return prefix + _dumps(text) + b'}'
+    
+    def _user_response_topic(self, to_id: str) -> str:
+        """
+        Get the user-specific response topic for a node, e.g. <response channel>/!abcd1234
+        
+        Args:
+            to_id: Node ID, with or without the leading '!'
+            
+        Returns:
+            str: Response topic for that node
+        """
+        topic = self._user_topics.get(to_id)
+        if topic is None:
+            user_suffix = to_id if to_id.startswith('!') else f"!{to_id}"
+            topic = self._user_topics[to_id] = f"{self._user_topic_prefix}{user_suffix}"
+        return topic
+    
     def connect(self) -> bool:
         """
         Connect to the MQTT broker
@@ -93,17 +365,25 @@ class MeshtasticMqttClient:
             self.client.on_connect = self._on_connect
             self.client.on_message = self._on_message
             self.client.on_disconnect = self._on_disconnect
+            self.client.on_socket_open = self._on_socket_open
+            
+            self.client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+            self.client.max_queued_messages_set(0)  # Never drop queued publishes
+            
+            # Let paho route our topics straight to their handlers; _on_message
+            # only sees messages that match none of these filters
+            for topic_filter, handler in self._topic_handlers():
+                self.client.message_callback_add(topic_filter, self._topic_callback(handler))
             
             # Connect to the broker
+            self._connected_event.clear()
             self.client.connect(self.broker, self.port, keepalive=60)
             
             # Start the MQTT loop in a background thread
             self.client.loop_start()
             
-            # Wait for connection to be established
-            start_time = time.time()
-            while not self.connected and time.time() - start_time < 10:
-                time.sleep(0.1)
+            # Wait for the broker to accept or refuse the connection
+            self._connected_event.wait(timeout=10.0)
             
             return self.connected
             
@@ -120,10 +400,26 @@ class MeshtasticMqttClient:
                 self.client.disconnect()
                 self.client.loop_stop()
                 self.connected = False
+                self._connected_event.clear()
                 logger.info("Disconnected from MQTT broker")
             except Exception as e:
                 logger.error(f"Error disconnecting from MQTT broker: {str(e)}")
     
+    def _on_socket_open(self, client, userdata, sock):
+        """
+        Callback for when paho opens a socket to the broker, including on reconnect
+        
+        Disables Nagle's algorithm, so small publishes are not held back waiting
+        for an ACK, and enlarges the socket buffers.
+        """
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        except (OSError, AttributeError) as e:
+            # Websocket transports don't expose setsockopt
+            logger.warning(f"Could not set MQTT socket options: {str(e)}")
+    
     def _on_connect(self, client, userdata, flags, rc):
         """
         Callback for when the client connects to the broker
@@ -131,6 +427,7 @@ class MeshtasticMqttClient:
         if rc == 0:
             logger.info(f"Connected to MQTT broker at {self.broker}:{self.port}")
             self.connected = True
+            self._connected_event.set()
             
             # Subscribe to Meshtastic topics
             self.client.subscribe(self.rx_topic_prefix)
@@ -138,15 +435,16 @@ class MeshtasticMqttClient:
             
             # Subscribe to LLM channel if enabled
             if self.use_llm_channel and self.llm_channel:
-                self.client.subscribe(self.llm_channel)
-                logger.info(f"Subscribed to LLM channel: {self.llm_channel}")
-                
-                # Also subscribe to all channel messages that might come from Meshtastic
+                # Subscribe to all channel messages that might come from Meshtastic
                 # Format: msh/[region]/[channel_index]/#
-                # This ensures we catch all messages on all channels
+                # This ensures we catch all messages on all channels, and already
+                # covers the LLM channel itself; subscribing to both would make the
+                # broker deliver every LLM channel message twice
                 channel_base = "/".join(self.llm_channel.split("/")[:-1])
-                self.client.subscribe(f"{channel_base}/#")
-                logger.info(f"Subscribed to all channel messages: {channel_base}/#")
+                # A single-level channel name has no parent; "/#" would not match it
+                channel_filter = f"{channel_base}/#" if channel_base else f"{self._llm_channel_prefix}/#"
+                self.client.subscribe(channel_filter)
+                logger.info(f"Subscribed to LLM channel {self.llm_channel} via {channel_filter}")
                 
                 # Log that we'll be responding on a different channel
                 logger.info(f"Will respond on LLM response channel: {self.llm_response_channel}")
@@ -156,15 +454,18 @@ class MeshtasticMqttClient:
             
             # Send startup message if enabled
             if self.send_startup_message:
-                self.send_broadcast("📢 LLM Agent is now online")
+                self.send_broadcast(self._STARTUP_ECHO)
         else:
             logger.error(f"Failed to connect to MQTT broker, return code: {rc}")
+            # Wake connect() so a refused connection fails without waiting out the timeout
+            self._connected_event.set()
     
     def _on_disconnect(self, client, userdata, rc):
         """
         Callback for when the client disconnects from the broker
         """
         self.connected = False
+        self._connected_event.clear()
         if rc != 0:
             logger.warning(f"Unexpected disconnection from MQTT broker, return code: {rc}")
         else:
@@ -172,242 +473,315 @@ class MeshtasticMqttClient:
     
     def _on_message(self, client, userdata, msg):
         """
-        Callback for when a message is received from the broker
+        Callback for messages that match none of the per-topic callbacks
         """
         try:
-            topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            
-            logger.debug(f"Received message on topic: {topic}")
-            logger.debug(f"Payload: {payload[:100]}...")  # Log first 100 chars
+            # Route on the topic first so messages we don't handle are never parsed
+            handler = self._route_topic(msg.topic)
+        except Exception as e:
+            logger.error("Error in message handler: %s", e)
+            return
+        
+        if handler is None:
+            logger.debug("Ignoring message on topic: %s", msg.topic)
+            return
+        
+        self._dispatch(msg, handler)
+    
+    def _topic_handlers(self) -> List[Tuple[str, Callable[[str, Any, bytes], None]]]:
+        """
+        List the topic filters we handle, with the handler for each
+        
+        Returns:
+            List of (topic filter, handler) pairs
+        """
+        handlers = []
+        if self.use_llm_channel and self._llm_channel_prefix:
+            # "prefix/#" also matches the bare prefix
+            handlers.append((f"{self._llm_channel_prefix}/#", self._handle_llm_channel))
+        handlers.append((self.rx_topic_prefix, self._handle_rx))
+        handlers.append((self.nodeinfo_topic_prefix, self._handle_nodeinfo))
+        return handlers
+    
+    def _topic_callback(self, handler: Callable[[str, Any, bytes], None]) -> Callable:
+        """
+        Wrap a handler as a paho per-topic message callback
+        
+        Args:
+            handler: Handler to call with (topic, data, payload)
             
-            # Check if this is a message from the LLM channel
-            is_llm_channel = False
-            if self.use_llm_channel and self.llm_channel:
-                # Check if the topic starts with the LLM channel prefix
-                if topic.startswith(self.llm_channel.rstrip('/')) or topic.startswith(self.llm_channel):
-                    is_llm_channel = True
-                    logger.info(f"Detected message from LLM channel: {topic}")
-                    
-                    # Log the full payload for debugging
-                    logger.info(f"LLM channel payload: {payload}")
+        Returns:
+            Callback taking paho's (client, userdata, msg) arguments
+        """
+        def callback(client, userdata, msg):
+            self._dispatch(msg, handler)
+        return callback
+    
+    def _dispatch(self, msg, handler: Callable[[str, Any, bytes], None]):
+        """
+        Parse a message's payload and pass it to its handler
+        
+        Args:
+            msg: paho MQTTMessage
+            handler: Handler to call with (topic, data, payload)
+        """
+        try:
+            topic = msg.topic
+            payload = msg.payload  # bytes; decoded only where text is needed
             
-            # Process LLM channel messages first
-            if is_llm_channel:
-                try:
-                    # Extract the message text and metadata
-                    text = None
-                    from_id = None
-                    to_id = None
-                    
-                    try:
-                        data = json.loads(payload)
-                        logger.info(f"Parsed JSON data: {data}")
-                        
-                        # Extract key information - assume fields may be missing
-                        text = None
-                        from_id = None
-                        to_id = None
-                        message_type = data.get('type', '')
-                        
-                        # Process based on message type and format
-                        
-                        # Case 1: Meshtastic native 'text' type message
-                        if message_type == 'text' and isinstance(data.get('payload'), dict):
-                            text = data['payload'].get('text', '')
-                            from_id = data.get('sender') or str(data.get('from', ''))
-                            to_id = str(data.get('to', 'broadcast'))
-                            logger.info(f"Detected native Meshtastic text message from {from_id}: {text[:50]}...")
-                            
-                            # Create message object and process it directly
-                            if text:
-                                message = {
-                                    "text": text,
-                                    "from_id": from_id,
-                                    "to_id": to_id,
-                                    "sender": from_id,
-                                    "timestamp": time.time(),
-                                    "is_direct": to_id != "broadcast" and to_id != 4294967295,
-                                    "is_llm_channel": True
-                                }
-                                logger.info(f"Processing native Meshtastic text message: {text}")
-                                self._process_message(message)
-                            return  # Skip further processing
-                        
-                        # Case 2: Our custom 'sendtext' format
-                        elif message_type == 'sendtext' and isinstance(data.get('payload'), dict):
-                            text = data['payload'].get('text', '')
-                            from_id = data['payload'].get('from_id') or str(data.get('from', ''))
-                            to_id = data['payload'].get('to_id')
-                            logger.info(f"Detected custom sendtext message from {from_id}: {text[:50]}...")
-                        
-                        # Case 3: Any JSON with a payload containing text field
-                        elif isinstance(data.get('payload'), dict) and 'text' in data.get('payload', {}):
-                            text = data['payload']['text']
-                            from_id = data.get('sender') or str(data.get('from', ''))
-                            to_id = str(data.get('to', 'broadcast'))
-                            logger.info(f"Detected JSON message with text payload from {from_id}: {text[:50]}...")
-                        
-                        # Case 4: Direct text field
-                        elif 'text' in data:
-                            text = data.get('text', '')
-                            from_id = data.get('from_id') or data.get('sender', 'unknown')
-                            to_id = data.get('to_id') or data.get('to', 'broadcast')
-                            logger.info(f"Detected JSON with direct text field from {from_id}: {text[:50]}...")
-                        
-                        # Case 5: Any other format - try common field names
-                        else:
-                            # Try to extract text from any field that might contain it
-                            for key in ['text', 'message', 'content', 'body']:
-                                if key in data and isinstance(data[key], str):
-                                    text = data[key]
-                                    break
-                            
-                            # If no text found, use the entire payload as text
-                            if not text:
-                                text = payload
-                            
-                            # Try to extract sender info
-                            for key in ['from', 'from_id', 'sender', 'user', 'userId']:
-                                if key in data:
-                                    from_id = str(data[key])
-                                    break
-                            
-                            # If no sender found, extract from topic if possible
-                            if not from_id:
-                                topic_parts = topic.split('/')
-                                if len(topic_parts) >= 1:
-                                    last_part = topic_parts[-1]
-                                    if last_part.startswith('!'):
-                                        from_id = last_part
-                                    else:
-                                        from_id = "unknown"
-                                else:
-                                    from_id = "unknown"
-                            
-                            logger.info(f"Detected generic JSON message from {from_id}: {text[:50]}...")
-                        
-                    except json.JSONDecodeError:
-                        # Not JSON, treat as plain text
-                        text = payload
-                        from_id = "unknown"
-                        
-                        # Try to extract from_id from topic
-                        topic_parts = topic.split('/')
-                        if len(topic_parts) >= 1:
-                            last_part = topic_parts[-1]
-                            if last_part.startswith('!'):
-                                from_id = last_part
-                            else:
-                                from_id = "unknown"
-                        
-                        logger.info(f"Detected plain text message from {from_id}: {text[:50]}...")
-                    
-                    # Skip empty messages
-                    if not text:
-                        logger.debug("Ignoring empty message")
-                        return
-                    
-                    # Skip messages that are just echoes of our startup message
-                    if text.startswith("📢 LLM Agent is now online"):
-                        logger.debug("Ignoring startup message echo")
-                        return
-                        
-                    # Create message object
-                    message = {
-                        "text": text,
-                        "from_id": from_id,
-                        "to_id": to_id or "broadcast",
-                        "sender": from_id,
-                        "timestamp": time.time(),
-                        "is_direct": True,  # Treat LLM channel messages as direct
-                        "is_llm_channel": True
-                    }
-                    
-                    # Process message directly instead of queueing
-                    logger.info(f"Processing LLM channel message from {from_id}: {text}")
-                    self._process_message(message)
-                    
-                except Exception as e:
-                    logger.error(f"Error processing LLM channel message: {str(e)}")
-                    logger.error(traceback.format_exc())
-                
-                return  # Skip further processing
+            logger.debug("Received message on topic: %s", topic)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Payload: %r...", payload[:100])  # Log first 100 bytes
             
-            # Process regular Meshtastic messages
-            # Process based on topic
-            if topic.startswith(self.rx_topic_prefix):
+            # Parse the payload once; the handler reuses the result
+            data = None
+            if payload[:1] in (b'{', b'['):
                 try:
-                    # Parse JSON payload
-                    data = json.loads(payload)
-                    
-                    # Extract message data
-                    packet_id = data.get('id', 'unknown')
-                    from_node_id = data.get('fromId', 'unknown')
-                    to_node_id = data.get('toId', 'broadcast')
-                    channel = data.get('channel', 0)
-                    text = data.get('text', '')
-                    
-                    # Skip our own messages to avoid feedback loops
-                    if from_node_id == self.my_node_id:
-                        logger.debug(f"Ignoring our own message: {text[:50]}...")
-                        return
-                    
-                    # Create message object
-                    message = {
-                        "text": text,
-                        "from_id": from_node_id,
-                        "to_id": to_node_id,
-                        "sender": from_node_id,
-                        "channel": channel,
-                        "packet_id": packet_id,
-                        "timestamp": time.time(),
-                        "is_direct": to_node_id != "broadcast",
-                        "is_llm_channel": False
-                    }
-                    
-                    # Add to processing queue
-                    self.message_queue.put(message)
-                    logger.info(f"Queued message from {from_node_id}: {text}")
-                    
+                    data = _loads(payload)
                 except json.JSONDecodeError:
-                    logger.warning(f"Invalid JSON in message: {payload}")
-                except Exception as e:
-                    logger.error(f"Error processing message: {str(e)}")
+                    logger.debug("Payload on %s is not valid JSON", topic)
             
-            # Process node info
-            elif topic.startswith(self.nodeinfo_topic_prefix):
-                try:
-                    # Parse JSON payload
-                    try:
-                        data = json.loads(payload)
-                        
-                        # Extract node info
-                        node_id = data.get('num', 'unknown')
-                        node_name = data.get('user', {}).get('longName', 'unknown')
-                        
-                        # Store node info
-                        self.nodes[node_id] = {
-                            "id": node_id,
-                            "name": node_name,
-                            "last_seen": time.time()
-                        }
-                        
-                        logger.info(f"Updated node info for {node_id} ({node_name})")
-                        
-                        # If this is our node, store our node ID
-                        if node_name == "llm_agent":
-                            self.my_node_id = node_id
-                            logger.info(f"Identified our node ID: {node_id}")
-                            
-                    except json.JSONDecodeError:
-                        logger.warning(f"Invalid JSON in node info: {payload}")
-                        
-                except Exception as e:
-                    logger.error(f"Error processing node info: {str(e)}")
+            handler(topic, data, payload)
             
         except Exception as e:
-            logger.error(f"Error in message handler: {str(e)}")
+            logger.error("Error in message handler: %s", e)
+    
+    def _route_topic(self, topic: str) -> Optional[Callable[[str, Any, bytes], None]]:
+        """
+        Pick the handler for a topic
+        
+        Args:
+            topic: MQTT topic a message arrived on
+            
+        Returns:
+            The handler method, or None if the topic is not one we process
+        """
+        # LLM channel messages take priority over the regular Meshtastic topics
+        if self.use_llm_channel and self._llm_channel_prefix:
+            if topic == self._llm_channel_prefix or topic.startswith(self._llm_channel_subtopics):
+                return self._handle_llm_channel
+        
+        # Everything else we handle lives under msh/
+        if not topic.startswith(self._topic_prefix):
+            return None
+        if topic.endswith(self._rx_suffix):
+            return self._handle_rx
+        if topic.endswith(self._nodeinfo_suffix):
+            return self._handle_nodeinfo
+        return None
+    
+    def _handle_llm_channel(self, topic, data, payload):
+        """
+        Handle a message received on the LLM channel
+        
+        Args:
+            topic: MQTT topic the message arrived on
+            data: Parsed JSON payload, or None if the payload is not JSON
+            payload: Raw payload bytes
+        """
+        logger.info("Detected message from LLM channel: %s", topic)
+        
+        # Log the full payload for debugging
+        logger.info("LLM channel payload: %r", payload)
+        
+        try:
+            # Extract the message text and metadata
+            text, from_id, to_id, is_direct = self._extract_text_and_sender(data, topic, payload)
+            
+            # Skip empty messages
+            if not text:
+                logger.debug("Ignoring empty message")
+                return
+            
+            # Skip messages that are just echoes of our startup message
+            if text.startswith(self._STARTUP_ECHO):
+                logger.debug("Ignoring startup message echo")
+                return
+            
+            # Create message object
+            message = RxMessage(
+                text=text,
+                from_id=from_id,
+                to_id=to_id or "broadcast",
+                sender=from_id,
+                timestamp=time.time(),
+                is_direct=is_direct,
+                is_llm_channel=True
+            )
+            
+            # Queue the message; the callback may run the LLM for seconds and
+            # must not block paho's network thread (keepalives, other messages)
+            self._enqueue_message(message)
+            logger.info("Queued LLM channel message from %s: %s", from_id, text)
+        
+        except Exception as e:
+            logger.exception("Error processing LLM channel message: %s", e)
+    
+    def _extract_text_and_sender(self, data, topic: str, payload: bytes) -> Tuple[str, str, Optional[str], bool]:
+        """
+        Pull the text, sender and destination out of an LLM channel message
+        
+        Args:
+            data: Parsed JSON payload, or None if the payload is not JSON
+            topic: MQTT topic the message arrived on
+            payload: Raw payload bytes
+            
+        Returns:
+            Tuple of (text, from_id, to_id, is_direct). LLM channel messages are
+            treated as direct unless a native message is addressed to broadcast.
+        """
+        if data is None:
+            # Not JSON, treat as plain text
+            text = payload.decode('utf-8')
+            from_id = _sender_from_topic(topic)
+            logger.info("Detected plain text message from %s: %.50s...", from_id, text)
+            return text, from_id, None, True
+        
+        logger.info("Parsed JSON data: %s", data)
+        
+        inner = data.get('payload')
+        if not isinstance(inner, dict):
+            inner = None
+        
+        shape = _SHAPE_BY_TYPE.get(data.get('type')) if inner is not None else None
+        if shape is not None:
+            extract, label = shape
+            text, from_id, to_id, is_direct = extract(data, inner)
+            logger.info("Detected %s from %s: %.50s...", label, from_id, text)
+            return text, from_id, to_id, is_direct
+        
+        for matches, extract, label in _JSON_SHAPES:
+            if matches(data, inner):
+                text, from_id, to_id, is_direct = extract(data, inner)
+                logger.info("Detected %s from %s: %.50s...", label, from_id, text)
+                return text, from_id, to_id, is_direct
+        
+        # Any other format - try common field names, else use the entire payload
+        text = None
+        for key in _TEXT_KEYS:
+            value = data.get(key)
+            if isinstance(value, str):
+                text = value
+                break
+        if not text:
+            text = payload.decode('utf-8')
+        
+        from_id = None
+        for key in _SENDER_KEYS:
+            value = data.get(key)
+            if value is not None:
+                from_id = str(value)
+                break
+        if not from_id:
+            from_id = _sender_from_topic(topic)
+        
+        logger.info("Detected generic JSON message from %s: %.50s...", from_id, text)
+        return text, from_id, None, True
+    
+    def _handle_rx(self, topic, data, payload):
+        """
+        Handle a regular Meshtastic text message
+        
+        Args:
+            topic: MQTT topic the message arrived on
+            data: Parsed JSON payload, or None if the payload is not JSON
+            payload: Raw payload bytes
+        """
+        if data is None:
+            logger.warning("Invalid JSON in message: %r", payload)
+            return
+        
+        try:
+            # Extract message data
+            packet_id = data.get('id', 'unknown')
+            from_node_id = data.get('fromId', 'unknown')
+            to_node_id = data.get('toId', 'broadcast')
+            channel = data.get('channel', 0)
+            text = data.get('text', '')
+            
+            # Skip our own messages to avoid feedback loops
+            if from_node_id == self.my_node_id:
+                logger.debug("Ignoring our own message: %.50s...", text)
+                return
+            
+            # Create message object
+            message = RxMessage(
+                text=text,
+                from_id=from_node_id,
+                to_id=to_node_id,
+                sender=from_node_id,
+                channel=channel,
+                packet_id=packet_id,
+                timestamp=time.time(),
+                is_direct=to_node_id != "broadcast",
+                is_llm_channel=False
+            )
+            
+            # Add to processing queue
+            self._enqueue_message(message)
+            logger.info("Queued message from %s: %s", from_node_id, text)
+        
+        except Exception as e:
+            logger.error("Error processing message: %s", e)
+    
+    def _handle_nodeinfo(self, topic, data, payload):
+        """
+        Handle a node info announcement
+        
+        Args:
+            topic: MQTT topic the message arrived on
+            data: Parsed JSON payload, or None if the payload is not JSON
+            payload: Raw payload bytes
+        """
+        if data is None:
+            logger.warning("Invalid JSON in node info: %r", payload)
+            return
+        
+        try:
+            # Extract node info
+            node_id = data.get('num', 'unknown')
+            node_name = data.get('user', {}).get('longName', 'unknown')
+            
+            # Store node info
+            self.nodes[node_id] = {
+                "id": node_id,
+                "name": node_name,
+                "last_seen": time.time()
+            }
+            
+            logger.info("Updated node info for %s (%s)", node_id, node_name)
+            
+            # If this is our node, store our node ID
+            if node_name == self._SELF_ID:
+                self.my_node_id = node_id
+                logger.info("Identified our node ID: %s", node_id)
+                
+        except Exception as e:
+            logger.error("Error processing node info: %s", e)
+    
+    def _enqueue_message(self, message: RxMessage):
+        """
+        Hand a received message to the processing thread
+        
+        Args:
+            message: Message to process
+        """
+        self.message_queue.append(message)
+        self._msg_event.set()
+    
+    def _build_sendtext_payload(self, text: str, to_id: str) -> bytes:
+        """
+        Build the JSON bytes of a sendtext message for the LLM response channel
+        
+        Args:
+            text: Response text
+            to_id: Destination node ID, or "broadcast"
+            
+        Returns:
+            bytes: Serialized message, ready to publish
+        """
+        # Only the two variable values go through the JSON encoder, for escaping
+        return self._SENDTEXT_TEMPLATE % (_dumps(text), _dumps(to_id))
     
     def _process_message(self, message):
         """
@@ -417,12 +791,11 @@ class MeshtasticMqttClient:
             # Extract message data
             text = message.get('text', '')
             from_id = message.get('from_id', 'unknown')
-            to_id = message.get('to_id', 'broadcast')
             is_direct = message.get('is_direct', False)
             is_llm_channel = message.get('is_llm_channel', False)
             
-            logger.info(f"Processing message from {from_id}: {text[:50]}...")
-            logger.info(f"Message details: is_direct={is_direct}, is_llm_channel={is_llm_channel}")
+            logger.info("Processing message from %s: %.50s...", from_id, text)
+            logger.info("Message details: is_direct=%s, is_llm_channel=%s", is_direct, is_llm_channel)
             
             # Skip empty messages
             if not text:
@@ -430,73 +803,68 @@ class MeshtasticMqttClient:
                 return
             
             # Skip our own messages to avoid feedback loops
-            if from_id == self.my_node_id or from_id == "llm_agent":
-                logger.debug(f"Ignoring our own message: {text[:50]}...")
+            if from_id == self.my_node_id or from_id == self._SELF_ID:
+                logger.debug("Ignoring our own message: %.50s...", text)
                 return
             
-            # Generate response using the agent
-            try:
-                # Generate response
-                if self.message_callback:
-                    logger.info("Calling message callback function to generate response")
-                    response = self.message_callback(message)
-                    logger.info(f"Callback returned response: {response[:50] if response else 'None'}...")
-                else:
-                    logger.warning("No message callback set")
-                    return
-                
-                # Skip empty responses
-                if not response:
-                    logger.warning("Empty response from agent")
-                    return
-                
-                logger.info(f"Generated response: {response[:50]}...")
-                
-                # Send response
-                if is_llm_channel:
-                    # For LLM channel messages, send response to the LLM response channel
-                    # Format the response as a Meshtastic JSON message
-                    response_data = {
-                        "from": 1234567890,  # Placeholder ID for LLM agent
-                        "type": "sendtext",
-                        "payload": {
-                            "text": response,
-                            "from_id": "llm_agent",
-                            "to_id": from_id if is_direct else "broadcast"
-                        }
-                    }
-                    
-                    # Send to LLM response channel
-                    success = self.publish_to_llm_response_channel(response_data)
-                    if success:
-                        logger.info(f"Sent response to {self.llm_response_channel} for {from_id}: {response[:50]}...")
-                    else:
-                        logger.error(f"Failed to send response to {self.llm_response_channel} for {from_id}")
-                else:
-                    # For regular Meshtastic messages
-                    # Send direct or broadcast response based on private mode and message type
-                    if self.private_mode or is_direct:
-                        # Send direct response to the sender
-                        success = self.send_direct_message(from_id, response)
-                        if success:
-                            logger.info(f"Sent direct response to {from_id}: {response[:50]}...")
-                        else:
-                            logger.error(f"Failed to send direct response to {from_id}")
-                    else:
-                        # Send broadcast response
-                        success = self.send_broadcast_message(response)
-                        if success:
-                            logger.info(f"Sent broadcast response: {response[:50]}...")
-                        else:
-                            logger.error(f"Failed to send broadcast response")
+            if not self.message_callback:
+                logger.warning("No message callback set")
+                return
             
-            except Exception as e:
-                logger.error(f"Error generating response: {str(e)}")
-                logger.error(traceback.format_exc())
+            # The callback may send its response itself through send_response()
+            logger.info("Calling message callback function to generate response")
+            response = self.message_callback(message)
+            if response:
+                self.send_response(response, message)
                 
         except Exception as e:
-            logger.error(f"Error processing message: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error processing message: %s", e)
+    
+    def send_response(self, response: str, message) -> bool:
+        """
+        Send a response to a previously received message
+        
+        Messages from the LLM channel are answered on the LLM response channel;
+        others with a direct message in private mode or to direct messages, and
+        with a broadcast otherwise.
+        
+        Args:
+            response: Response text
+            message: Message the response answers
+            
+        Returns:
+            bool: True if the response was sent successfully, False otherwise
+        """
+        from_id = message.get('from_id', 'unknown')
+        is_direct = message.get('is_direct', False)
+        
+        if message.get('is_llm_channel', False):
+            # For LLM channel messages, send response to the LLM response channel
+            # Format the response as a Meshtastic JSON message
+            response_data = self._build_sendtext_payload(response, from_id if is_direct else "broadcast")
+            
+            # Send to LLM response channel
+            success = self.publish_to_llm_response_channel(response_data)
+            if success:
+                logger.info("Sent response to %s for %s: %.50s...", self.llm_response_channel, from_id, response)
+            else:
+                logger.error("Failed to send response to %s for %s", self.llm_response_channel, from_id)
+        elif self.private_mode or is_direct:
+            # Send direct response to the sender
+            success = self.send_direct_message(from_id, response)
+            if success:
+                logger.info("Sent direct response to %s: %.50s...", from_id, response)
+            else:
+                logger.error("Failed to send direct response to %s", from_id)
+        else:
+            # Send broadcast response
+            success = self.send_broadcast_message(response)
+            if success:
+                logger.info("Sent broadcast response: %.50s...", response)
+            else:
+                logger.error("Failed to send broadcast response")
+        
+        return success
     
     def send_broadcast(self, text: str) -> bool:
         """
@@ -517,7 +885,7 @@ class MeshtasticMqttClient:
             topic = self.tx_topic
             payload = text
             
-            result = self.client.publish(topic, payload, qos=1)
+            result = self.client.publish(topic, payload, qos=self.broadcast_qos)
             if result.rc != 0:
                 logger.error(f"Failed to send broadcast message: {result.rc}")
                 return False
@@ -553,13 +921,10 @@ class MeshtasticMqttClient:
             if self.my_node_id is None:
                 logger.warning("Our node ID is unknown, sending via broadcast topic with 'to' field")
                 topic = self.tx_topic
-                payload = json.dumps({
-                    "text": text,
-                    "to": to_id
-                })
+                payload = self._addressed_broadcast_payload(text, to_id)
             else:
                 # Send via our node's txt topic with 'to' field
-                topic = f"{self.base_topic}/{self.my_node_id}/c/{to_id}/txt"
+                topic = self._direct_topic(to_id)
                 payload = text
             
             result = self.client.publish(topic, payload, qos=1)
@@ -567,7 +932,7 @@ class MeshtasticMqttClient:
                 logger.error(f"Failed to send direct message to {to_id}: {result.rc}")
                 return False
             
-            logger.info(f"Direct message sent to {to_id}: {text}")
+            logger.info("Direct message sent to %s: %s", to_id, text)
             return True
             
         except Exception as e:
@@ -606,6 +971,7 @@ class MeshtasticMqttClient:
         Stop the message processing thread
         """
         self.running = False
+        self._msg_event.set()
         
         # Wait for thread to finish
         if self.message_thread and self.message_thread.is_alive():
@@ -622,16 +988,15 @@ class MeshtasticMqttClient:
         """
         while self.running:
             try:
-                # Get message from queue with timeout
-                try:
-                    message = self.message_queue.get(timeout=1.0)
-                except queue.Empty:
+                # Wait for a message; stop() sets the event too, so no timeout is needed
+                if not self.message_queue:
+                    self._msg_event.wait()
+                    self._msg_event.clear()
                     continue
                 
-                # Process the message
-                self._process_message(message)
-                
-                self.message_queue.task_done()
+                # Process everything queued so far before waiting again
+                while self.message_queue and self.running:
+                    self._process_message(self.message_queue.popleft())
                 
             except Exception as e:
                 logger.error(f"Error in message processing thread: {str(e)}")
@@ -654,21 +1019,24 @@ class MeshtasticMqttClient:
             logger.error(f"Error requesting node information: {str(e)}")
             return False
 
-    def publish_to_llm_response_channel(self, data):
+    def publish_to_llm_response_channel(self, data, qos: int = 0):
         """
         Publish a message to the LLM response channel
         
         Args:
-            data: Data to publish (will be converted to JSON)
+            data: Data to publish; dicts are serialized to JSON, str and bytes
+                are published as they are
+            qos: MQTT QoS level. Chat responses default to 0: a lost reply is
+                re-asked by the user, and duplicate requests are already
+                filtered by sender and text, so a broker ACK round-trip buys nothing
             
         Returns:
             bool: True if published successfully, False otherwise
         """
         try:
-            if not self.client or not self.client.is_connected():
+            if not self.connected:
                 logger.warning("MQTT client not connected, attempting to reconnect")
-                self.connect()
-                if not self.client or not self.client.is_connected():
+                if not self.connect():
                     logger.error("Failed to reconnect to MQTT, cannot publish response")
                     return False
                     
@@ -678,18 +1046,26 @@ class MeshtasticMqttClient:
                 
             logger.info(f"Publishing to LLM response channel: {self.llm_response_channel}")
             
-            # Convert to JSON if needed
-            if isinstance(data, dict):
-                json_data = json.dumps(data)
-            else:
+            # Convert to JSON if needed (paho publishes bytes as-is)
+            if isinstance(data, (bytes, str)):
                 json_data = data
+            else:
+                json_data = _dumps(data)
                 
             # Publish the message
-            result = self.client.publish(self.llm_response_channel, json_data)
+            result = self.client.publish(self.llm_response_channel, json_data, qos=qos)
+            
+            # self.connected is kept by on_connect/on_disconnect and can lag behind a
+            # dropped socket, so only ask the client itself once a publish has failed
+            if result.rc != mqtt.MQTT_ERR_SUCCESS and not self.client.is_connected():
+                logger.warning("MQTT connection lost while publishing, attempting to reconnect")
+                self.connected = False
+                if self.connect():
+                    result = self.client.publish(self.llm_response_channel, json_data, qos=qos)
             
             # Check if the message was published successfully
             if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"Successfully published response to LLM response channel: {str(data)[:50]}...")
+                logger.info("Successfully published response to LLM response channel: %.50s...", data)
                 return True
             else:
                 logger.error(f"Failed to publish to LLM response channel, error code: {result.rc}")
@@ -730,7 +1106,7 @@ class MeshtasticMqttClient:
                         # Check if this is a direct message (not broadcast)
                         is_direct = to_id != 'broadcast'
                     
-                    payload_str = json.dumps(payload)
+                    payload_str = _dumps(payload)  # bytes; paho publishes them as-is
                 else:
                     payload_str = str(payload)
                     is_direct = False
@@ -743,34 +1119,22 @@ class MeshtasticMqttClient:
             # Use user-specific response channel for direct messages
             response_channel = self.llm_response_channel
             if is_direct and to_id:
-                # If the to_id doesn't start with '!', add it
-                if not to_id.startswith('!'):
-                    user_suffix = f"!{to_id}"
-                else:
-                    user_suffix = to_id
-                
-                # Add the user ID to the response channel
-                if response_channel.endswith('/'):
-                    response_channel = f"{response_channel}{user_suffix}"
-                else:
-                    response_channel = f"{response_channel}/{user_suffix}"
-                
+                response_channel = self._user_response_topic(to_id)
                 logger.info(f"Using user-specific response channel: {response_channel}")
             
             # Publish to the appropriate response channel
             logger.info(f"Publishing to LLM response channel: {response_channel}")
-            result = self.client.publish(response_channel, payload_str, qos=1)
+            result = self.client.publish(response_channel, payload_str, qos=self.llm_channel_qos)
             
             if result.rc != 0:
                 logger.error(f"Failed to publish to LLM response channel: {result.rc}")
                 return False
             else:
-                logger.info(f"Successfully sent message to LLM response channel: {payload_str[:50]}...")
+                logger.info("Successfully sent message to LLM response channel: %.50r...", payload_str)
                 return True
                 
         except Exception as e:
-            logger.error(f"Error sending to LLM response channel: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending to LLM response channel: %s", e)
             return False
 
     def send_direct_message(self, to_id: str, text: str) -> bool:
@@ -793,13 +1157,10 @@ class MeshtasticMqttClient:
             if self.my_node_id is None:
                 logger.warning("Our node ID is unknown, sending via broadcast topic with 'to' field")
                 topic = self.tx_topic
-                payload = json.dumps({
-                    "text": text,
-                    "to": to_id
-                })
+                payload = self._addressed_broadcast_payload(text, to_id)
             else:
                 # Send via our node's txt topic with 'to' field
-                topic = f"{self.base_topic}/{self.my_node_id}/c/{to_id}/txt"
+                topic = self._direct_topic(to_id)
                 payload = text
             
             result = self.client.publish(topic, payload, qos=1)
@@ -807,7 +1168,7 @@ class MeshtasticMqttClient:
                 logger.error(f"Failed to send direct message to {to_id}: {result.rc}")
                 return False
             
-            logger.info(f"Direct message sent to {to_id}: {text}")
+            logger.info("Direct message sent to %s: %s", to_id, text)
             return True
             
         except Exception as e:
@@ -833,7 +1194,7 @@ class MeshtasticMqttClient:
             topic = self.tx_topic
             payload = text
             
-            result = self.client.publish(topic, payload, qos=1)
+            result = self.client.publish(topic, payload, qos=self.broadcast_qos)
             if result.rc != 0:
                 logger.error(f"Failed to send broadcast message: {result.rc}")
                 return False
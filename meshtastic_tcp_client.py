@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 import logging
+import socket
 import time
 import threading
-import queue
-from typing import Dict, Any, List, Optional, Callable
+from collections import OrderedDict, deque
+from typing import Dict, Any, List, Optional, Callable, Tuple
 
 import meshtastic
 import meshtastic.tcp_interface
@@ -12,6 +13,41 @@ import meshtastic.tcp_interface
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Socket buffer sizes for the device connection (frames are small, but the device link can stall)
+SEND_BUFFER_SIZE = 64 * 1024
+RECEIVE_BUFFER_SIZE = 32 * 1024
+
+# Detect a dead connection after ~60s of silence (30s idle + 3 probes 10s apart)
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+# Number of recent (sender, packet ID) pairs remembered to drop repeated deliveries
+SEEN_PACKETS_CAPACITY = 512
+
+# Attempts per chunk when the connection drops mid-send (each retry reconnects first)
+SEND_ATTEMPTS = 3
+
+# Meshtastic text limit is ~200 bytes; leave room for a "[i/n] " prefix
+MAX_CHUNK_BYTES = 190
+
+class _FrameBuffer:
+    """Reusable buffer that collects framed packets for a single socket write"""
+    
+    __slots__ = ("data", "used")
+    
+    def __init__(self, size: int = 512):
+        self.data = bytearray(size)
+        self.used = 0
+    
+    def write(self, frame: bytes):
+        """Append a frame, growing the buffer if needed"""
+        end = self.used + len(frame)
+        if end > len(self.data):
+            self.data.extend(bytes(max(end - len(self.data), len(self.data))))
+        self.data[self.used:end] = frame
+        self.used = end
+
 class MeshtasticTcpClient:
     """Client for interacting with Meshtastic over TCP using the official Python library"""
     
@@ -31,22 +67,38 @@ class MeshtasticTcpClient:
         # Interface
         self.interface = None
         
+        # Socket we last applied our socket options to
+        self._tuned_socket = None
+        
+        # Serializes sends so chunks of different messages keep their pacing, and so
+        # no other send runs while send_batch() redirects the interface's writes
+        # into a buffer that is kept and reused between sends
+        self._send_lock = threading.Lock()
+        self._frame_buffer = _FrameBuffer()
+        
         # Connection status
         self.connected = False
         
         # Message handling
-        self.message_queue = queue.Queue()
+        self.message_queue = deque()  # one producer (meshtastic's reader thread), one consumer
+        self._msg_event = threading.Event()
         self.message_callback = None
         self.running = False
         self.message_thread = None
         
-        # Last message time to avoid duplicates
-        self.last_message_time = 0
+        # Set by stop() so connection waits and retry backoff end early
+        self._stop_event = threading.Event()
+        
+        # Recently seen (sender, packet ID) pairs, oldest first, to avoid duplicates
+        self._seen_packets = OrderedDict()
         
         # Node info
         self.my_node_id = None
         self.my_node_num = None
         self.known_nodes = {}
+        
+        # Lowercase channel name -> index on the local node, built after connecting
+        self._channel_index = {}
     
     def connect(self, max_retries=4, retry_delay=2.0) -> bool:
         """
@@ -59,6 +111,11 @@ class MeshtasticTcpClient:
         Returns:
             bool: True if connection is successful, False otherwise
         """
+        self.connected = False
+        
+        # An explicit connect after stop() should not be cut short by it
+        self._stop_event.clear()
+        
         for attempt in range(max_retries + 1):  # +1 because we start with attempt 0
             try:
                 if attempt == 0:
@@ -68,11 +125,15 @@ class MeshtasticTcpClient:
                 
                 # Connect to the device
                 self.interface = meshtastic.tcp_interface.TCPInterface(self.host, self.port)
+                self._tune_socket()
                 
                 # Wait for connection to establish (increase waiting time with each retry)
                 wait_time = min(2.0 + (attempt * 0.5), 5.0)  # Start with 2s, increase by 0.5s each retry, max 5s
                 logger.info(f"Waiting {wait_time:.1f}s for connection to establish...")
-                time.sleep(wait_time)
+                if self._stop_event.wait(wait_time):
+                    logger.info("Stop requested, abandoning connection attempt")
+                    self.interface.close()
+                    return False
                 
                 # Set callback for received messages
                 self.interface.onReceive = self._on_receive
@@ -92,17 +153,21 @@ class MeshtasticTcpClient:
                     # Get nodes
                     self.known_nodes = self.interface.nodes
                     if self.known_nodes:
-                        logger.info(f"Connected nodes: {list(self.known_nodes.keys())}")
-                        
-                        # Log node details
-                        for node_id, node in self.known_nodes.items():
-                            user_info = node.get('user', {})
-                            long_name = user_info.get('longName', 'Unknown')
-                            short_name = user_info.get('shortName', 'Unknown')
-                            logger.info(f"Node {node_id}: {long_name} ({short_name})")
+                        # Only walk the node table when INFO records will be emitted
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info("Connected nodes: %s", list(self.known_nodes))
+                            
+                            # Log node details
+                            for node_id, node in self.known_nodes.items():
+                                user_info = node.get('user', {})
+                                long_name = user_info.get('longName', 'Unknown')
+                                short_name = user_info.get('shortName', 'Unknown')
+                                logger.info("Node %s: %s (%s)", node_id, long_name, short_name)
                     else:
                         logger.warning("No nodes found")
                     
+                    self._build_channel_index()
+                    
                     self.connected = True
                     
                     # Log private mode status
@@ -125,7 +190,9 @@ class MeshtasticTcpClient:
                         # Exponential backoff for retries (1s, 2s, 4s, 8s...)
                         current_delay = retry_delay * (2 ** attempt)
                         logger.info(f"Retrying in {current_delay:.1f} seconds...")
-                        time.sleep(current_delay)
+                        if self._stop_event.wait(current_delay):
+                            logger.info("Stop requested, abandoning reconnection")
+                            return False
                         continue
                     else:
                         logger.error(f"Failed to get node info after {max_retries+1} attempts: {str(e)}")
@@ -137,7 +204,9 @@ class MeshtasticTcpClient:
                     # Exponential backoff for retries
                     current_delay = retry_delay * (2 ** attempt)
                     logger.info(f"Retrying in {current_delay:.1f} seconds...")
-                    time.sleep(current_delay)
+                    if self._stop_event.wait(current_delay):
+                        logger.info("Stop requested, abandoning reconnection")
+                        return False
                 else:
                     logger.error(f"Failed to connect to Meshtastic device after {max_retries+1} attempts: {str(e)}")
                     return False
@@ -149,14 +218,43 @@ class MeshtasticTcpClient:
         """
         Disconnect from the Meshtastic device
         """
+        self.connected = False
         if self.interface:
             try:
                 self.interface.close()
-                self.connected = False
                 logger.info("Disconnected from Meshtastic device")
             except Exception as e:
                 logger.error(f"Error disconnecting from Meshtastic device: {str(e)}")
     
+    def _tune_socket(self):
+        """
+        Disable Nagle's algorithm, size the buffers and enable keepalive on the interface's socket
+        
+        Responses are written as a few small packets; with Nagle enabled each one
+        after the first waits for the previous packet's ACK (~40ms with delayed ACKs).
+        The meshtastic library re-creates the socket when it reconnects internally,
+        so this is cheap to call before every send and only acts on a new socket.
+        """
+        sock = getattr(self.interface, 'socket', None)
+        if sock is None or sock is self._tuned_socket:
+            return
+        
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Keepalive timing options aren't available on every platform
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+            if hasattr(socket, 'TCP_KEEPINTVL'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTERVAL)
+            if hasattr(socket, 'TCP_KEEPCNT'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_COUNT)
+            self._tuned_socket = sock
+        except OSError as e:
+            logger.warning(f"Could not set TCP socket options: {str(e)}")
+    
     def _ensure_connected(self, max_retries=2):
         """
         Ensure that we have an active connection to the Meshtastic device.
@@ -168,8 +266,10 @@ class MeshtasticTcpClient:
         Returns:
             bool: True if connected (or reconnected), False otherwise
         """
-        # Check if we're connected
-        if not self.interface or not hasattr(self.interface, 'myInfo'):
+        # Check if we're connected (cleared by disconnect() and by send errors)
+        if not self.connected:
+            if self._stop_event.is_set():
+                return False
             logger.warning("TCP connection lost, attempting to reconnect...")
             reconnected = self.connect(max_retries=max_retries)
             if reconnected:
@@ -178,6 +278,9 @@ class MeshtasticTcpClient:
             else:
                 logger.error("Failed to reconnect to Meshtastic device")
                 return False
+        
+        # Re-apply socket options in case the library reconnected on its own
+        self._tune_socket()
         return True
     
     def _on_receive(self, packet, interface):
@@ -186,51 +289,69 @@ class MeshtasticTcpClient:
         """
         try:
             # Check if this is a text message
-            if packet.get('decoded', {}).get('portnum') == 'TEXT_MESSAGE_APP':
-                text = packet.get('decoded', {}).get('text', '')
-                if text:
-                    # Extract sender info
-                    from_id = packet.get('fromId', 'unknown')
-                    to_id = packet.get('toId', 'broadcast')
-                    
-                    # Skip messages from ourselves
-                    if from_id == self.my_node_id:
-                        return
-                    
-                    # In private mode, only process direct messages sent to us
-                    if self.private_mode and to_id != self.my_node_id:
-                        logger.info(f"Ignoring message not addressed to us (private mode): from={from_id}, to={to_id}, text={text}")
-                        return
-                    
-                    # Get sender name if available
-                    sender = "Unknown"
-                    try:
-                        if from_id in interface.nodes:
-                            user_info = interface.nodes[from_id].get('user', {})
-                            sender = user_info.get('longName', user_info.get('shortName', from_id))
-                    except Exception:
-                        pass
-                    
-                    # Create message object
-                    timestamp = time.time()
-                    message = {
-                        "text": text,
-                        "from_id": from_id,
-                        "to_id": to_id,
-                        "sender": sender,
-                        "timestamp": timestamp,
-                        "is_direct": to_id == self.my_node_id
-                    }
-                    
-                    # Check if this is a new message (avoid duplicates)
-                    if timestamp > self.last_message_time:
-                        self.last_message_time = timestamp
-                        
-                        # Add to processing queue
-                        self.message_queue.put(message)
-                        msg_type = "direct" if message["is_direct"] else "broadcast"
-                        logger.info(f"Queued {msg_type} message from {sender}: {text}")
-                    
+            decoded = packet.get('decoded')
+            if not decoded or decoded.get('portnum') != 'TEXT_MESSAGE_APP':
+                return
+            text = decoded.get('text')
+            if not text:
+                return
+            
+            my_id = self.my_node_id
+            
+            # Extract sender info
+            from_id = packet.get('fromId', 'unknown')
+            to_id = packet.get('toId', 'broadcast')
+            
+            # Skip messages from ourselves
+            if from_id == my_id:
+                return
+            
+            # Skip packets we've already seen (the mesh can deliver one more than once)
+            packet_id = packet.get('id')
+            if packet_id is not None:
+                seen = self._seen_packets
+                key = (from_id, packet_id)
+                if key in seen:
+                    logger.debug(f"Ignoring duplicate packet {packet_id} from {from_id}")
+                    return
+                seen[key] = None
+                if len(seen) > SEEN_PACKETS_CAPACITY:
+                    seen.popitem(last=False)
+            
+            is_direct = to_id == my_id
+            
+            # In private mode, only process direct messages sent to us
+            if self.private_mode and not is_direct:
+                logger.info("Ignoring message not addressed to us (private mode): from=%s, to=%s, text=%s",
+                            from_id, to_id, text)
+                return
+            
+            # Get sender name if available
+            sender = "Unknown"
+            try:
+                node = interface.nodes.get(from_id)
+                if node:
+                    user_info = node.get('user', {})
+                    sender = user_info.get('longName', user_info.get('shortName', from_id))
+            except Exception:
+                pass
+            
+            # Create message object
+            message = {
+                "text": text,
+                "from_id": from_id,
+                "to_id": to_id,
+                "sender": sender,
+                "timestamp": time.time(),
+                "is_direct": is_direct
+            }
+            
+            # Add to processing queue
+            self.message_queue.append(message)
+            self._msg_event.set()
+            msg_type = "direct" if is_direct else "broadcast"
+            logger.info(f"Queued {msg_type} message from {sender}: {text}")
+            
         except Exception as e:
             logger.error(f"Error in message handler: {str(e)}")
     
@@ -249,63 +370,235 @@ class MeshtasticTcpClient:
         if not self._ensure_connected():
             return False
             
-        try:
-            # Split message if it's too long (Meshtastic text limit is ~200 bytes)
-            max_chunk_size = 190
-            
-            if len(message) <= max_chunk_size:
-                chunks = [message]
-            else:
-                # Split into chunks
-                chunks = []
-                for i in range(0, len(message), max_chunk_size):
-                    chunk = message[i:i+max_chunk_size]
-                    chunks.append(chunk)
-            
-            # Send each chunk
-            for i, chunk in enumerate(chunks):
-                if len(chunks) > 1:
-                    prefix = f"[{i+1}/{len(chunks)}] "
-                    chunk = prefix + chunk
+        with self._send_lock:
+            try:
+                # Split message if it's too long (Meshtastic text limit is ~200 bytes)
+                chunks = self._split_message(message)
                 
-                # Determine if this is a direct message
-                is_direct = to_id is not None and to_id != "broadcast" and to_id != "^all"
-                msg_type = "direct" if is_direct else "broadcast"
+                # Send each chunk
+                for i, chunk in enumerate(chunks):
+                    # Determine if this is a direct message
+                    is_direct = to_id is not None and to_id != "broadcast" and to_id != "^all"
+                    msg_type = "direct" if is_direct else "broadcast"
+                    
+                    logger.info("Sending %s message: %s", msg_type, chunk)
+                    
+                    # Send the message
+                    if is_direct:
+                        # Send to specific node
+                        self.interface.sendText(chunk, destinationId=to_id)
+                    else:
+                        # Broadcast
+                        self.interface.sendText(chunk)
+                    
+                    # Brief pause between chunks
+                    if len(chunks) > 1 and i < len(chunks) - 1:
+                        if self._stop_event.wait(1):
+                            return False
                 
-                logger.info(f"Sending {msg_type} message: {chunk}")
+                return True
                 
-                # Send the message
-                if is_direct:
-                    # Send to specific node
-                    self.interface.sendText(chunk, destinationId=to_id)
+            except (BrokenPipeError, ConnectionResetError) as e:
+                logger.error(f"Connection error sending message: {str(e)}")
+                # Try to reconnect once
+                self.disconnect()
+                if self._ensure_connected():
+                    try:
+                        # Try once more after reconnection
+                        if to_id:
+                            self.interface.sendText(message, destinationId=to_id)
+                        else:
+                            self.interface.sendText(message)
+                        return True
+                    except Exception as retry_e:
+                        logger.error(f"Failed to send message after reconnection: {str(retry_e)}")
+                        return False
+                return False
+            except Exception as e:
+                logger.error(f"Error sending message: {str(e)}")
+                return False
+    
+    def send_batch(self, messages: List[Tuple[str, Optional[str], Optional[str]]]) -> List[bool]:
+        """
+        Send several messages to the device, writing each round of chunks at once
+        
+        All messages are split into chunks up front. The first chunk of every
+        message is framed into a buffer and handed to the interface in a single
+        write, then the second chunks after a 1s pause, and so on, so the radio
+        is paced the same way as send_message() but with one write per round
+        instead of one per packet.
+        
+        Args:
+            messages: (text, to_id, channel_name) tuples. Messages with a channel
+                name go to that channel, others to to_id (None for broadcast)
+            
+        Returns:
+            List[bool]: Whether each message was written to the device
+        """
+        results = [False] * len(messages)
+        
+        # First ensure we're connected
+        if not self._ensure_connected():
+            return results
+        
+        # (index, chunks, send keyword arguments) for each message still being sent
+        pending = []
+        for index, (text, to_id, channel_name) in enumerate(messages):
+            try:
+                if channel_name is not None:
+                    channel_num = self._find_channel_index(channel_name)
+                    logger.info("Sending message to channel %s (index %s): %s", channel_name, channel_num, text)
+                    pending.append((index, self._split_message(text, numbered=False), {"channelIndex": channel_num}))
+                elif to_id is not None and to_id != "broadcast" and to_id != "^all":
+                    logger.info("Sending direct message: %s", text)
+                    pending.append((index, self._split_message(text), {"destinationId": to_id}))
                 else:
-                    # Broadcast
-                    self.interface.sendText(chunk)
-                
-                # Brief pause between chunks
-                if len(chunks) > 1 and i < len(chunks) - 1:
-                    time.sleep(1)
+                    logger.info("Sending broadcast message: %s", text)
+                    pending.append((index, self._split_message(text), {}))
+            except Exception as e:
+                logger.error("Error preparing batched message: %s", e)
+        
+        with self._send_lock:
+            buffer = self._frame_buffer
+            write_bytes = self.interface._writeBytes
+            batch_thread = threading.get_ident()
             
-            return True
+            def capture(frame):
+                # Writes from other threads (e.g. the library's heartbeat) go straight out
+                if threading.get_ident() == batch_thread:
+                    buffer.write(frame)
+                else:
+                    write_bytes(frame)
             
-        except (BrokenPipeError, ConnectionResetError) as e:
-            logger.error(f"Connection error sending message: {str(e)}")
-            # Try to reconnect once
-            if self._ensure_connected():
+            chunk_number = 0
+            while pending:
+                if chunk_number and self._stop_event.wait(1):
+                    break
+                
+                buffer.used = 0
+                in_round = []
+                self.interface._writeBytes = capture
                 try:
-                    # Try once more after reconnection
-                    if to_id:
-                        self.interface.sendText(message, destinationId=to_id)
+                    for item in pending:
+                        index, chunks, kwargs = item
+                        try:
+                            self.interface.sendText(chunks[chunk_number], **kwargs)
+                            in_round.append(item)
+                        except Exception as e:
+                            # Stop sending the rest of this message
+                            logger.error("Error preparing batched message: %s", e)
+                finally:
+                    del self.interface._writeBytes
+                
+                if buffer.used:
+                    try:
+                        with memoryview(buffer.data) as view:
+                            write_bytes(view[:buffer.used])
+                    except OSError as e:
+                        logger.error("Connection error sending batched messages: %s", e)
+                        # Reconnect on the next send
+                        self.connected = False
+                        break
+                
+                chunk_number += 1
+                pending = []
+                for item in in_round:
+                    if chunk_number < len(item[1]):
+                        pending.append(item)
                     else:
-                        self.interface.sendText(message)
-                    return True
-                except Exception as retry_e:
-                    logger.error(f"Failed to send message after reconnection: {str(retry_e)}")
-                    return False
-            return False
-        except Exception as e:
-            logger.error(f"Error sending message: {str(e)}")
-            return False
+                        results[item[0]] = True
+        
+        return results
+    
+    def _split_message(self, message: str, numbered: bool = True) -> List[str]:
+        """
+        Split a message into chunks that fit in a Meshtastic text packet
+        
+        Args:
+            message: Text message to split
+            numbered: If True, prefix each chunk with "[i/n] " when there is more than one
+            
+        Returns:
+            List[str]: Chunks to send in order
+        """
+        data = message.encode('utf-8')
+        size = len(data)
+        if size <= MAX_CHUNK_BYTES:
+            return [message]
+        
+        # Cut the encoded text at byte offsets, decoding each chunk straight from a
+        # view of the one encoded copy
+        view = memoryview(data)
+        chunks = []
+        start = 0
+        while start < size:
+            end = start + MAX_CHUNK_BYTES
+            if end >= size:
+                end = size
+            else:
+                # Don't split a multi-byte character: back up to its first byte
+                while data[end] & 0xC0 == 0x80:
+                    end -= 1
+            chunks.append(str(view[start:end], 'utf-8'))
+            start = end
+        
+        if not numbered:
+            return chunks
+        return [f"[{i+1}/{len(chunks)}] {chunk}" for i, chunk in enumerate(chunks)]
+    
+    def _build_channel_index(self):
+        """
+        Index the local node's channels by lowercase name
+        
+        The first channel wins if two share a name, matching the order they were
+        searched in before the index existed.
+        """
+        self._channel_index = {}
+        if not (hasattr(self.interface, 'localNode') and hasattr(self.interface.localNode, 'channels')):
+            return
+        
+        # Log available channels for debugging
+        logger.info("Available channels:")
+        for idx, channel in enumerate(self.interface.localNode.channels):
+            if hasattr(channel, 'settings') and hasattr(channel.settings, 'name'):
+                logger.info(f"  Channel {idx}: {channel.settings.name}")
+                self._channel_index.setdefault(channel.settings.name.lower(), idx)
+            else:
+                logger.info(f"  Channel {idx}: <unnamed>")
+    
+    def _find_channel_index(self, channel_name: str) -> int:
+        """
+        Find the index of a channel on the local node by name
+        
+        Args:
+            channel_name: Channel name to look for
+            
+        Returns:
+            int: Index of the channel, or the default LLM channel index if not found
+        """
+        # The channel list may not have been downloaded yet when we connected
+        if not self._channel_index:
+            self._build_channel_index()
+        
+        # Try to find exact match first
+        name = channel_name.lower()
+        channel_num = self._channel_index.get(name)
+        
+        # If not found, try partial match
+        if channel_num is None:
+            for channel_key, idx in self._channel_index.items():
+                if name in channel_key:
+                    channel_num = idx
+                    logger.info(f"Found partial match for channel {channel_name} in {channel_key} at index {channel_num}")
+                    break
+        
+        if channel_num is None:
+            # If channel not found, use a hardcoded index
+            # The LLM channel is usually on channel 2
+            channel_num = 2  # Default to channel 2 for LLM communication
+            logger.warning(f"Channel {channel_name} not found in local node, using default channel index {channel_num}")
+        
+        return channel_num
     
     def send_to_channel(self, message: str, channel_name: str) -> bool:
         """
@@ -324,84 +617,42 @@ class MeshtasticTcpClient:
             
         try:
             # Split message if it's too long (Meshtastic text limit is ~200 bytes)
-            max_chunk_size = 190
-            
-            if len(message) <= max_chunk_size:
-                chunks = [message]
-            else:
-                # Split into chunks
-                chunks = []
-                for i in range(0, len(message), max_chunk_size):
-                    chunk = message[i:i+max_chunk_size]
-                    chunks.append(chunk)
+            chunks = self._split_message(message, numbered=False)
             
             # Attempt to find channel by name
-            channel_num = None
-            if hasattr(self.interface, 'localNode') and hasattr(self.interface.localNode, 'channels'):
-                # Log available channels for debugging
-                logger.info("Available channels:")
-                for idx, channel in enumerate(self.interface.localNode.channels):
-                    if hasattr(channel, 'settings') and hasattr(channel.settings, 'name'):
-                        logger.info(f"  Channel {idx}: {channel.settings.name}")
-                    else:
-                        logger.info(f"  Channel {idx}: <unnamed>")
-                
-                # Try to find exact match first
-                for idx, channel in enumerate(self.interface.localNode.channels):
-                    if hasattr(channel, 'settings') and hasattr(channel.settings, 'name'):
-                        if channel.settings.name.lower() == channel_name.lower():
-                            channel_num = idx
-                            logger.info(f"Found exact match for channel {channel_name} at index {channel_num}")
-                            break
-                
-                # If not found, try partial match
-                if channel_num is None:
-                    for idx, channel in enumerate(self.interface.localNode.channels):
-                        if hasattr(channel, 'settings') and hasattr(channel.settings, 'name'):
-                            if channel_name.lower() in channel.settings.name.lower():
-                                channel_num = idx
-                                logger.info(f"Found partial match for channel {channel_name} in {channel.settings.name} at index {channel_num}")
-                                break
-            
-            if channel_num is None:
-                # If channel not found, use a hardcoded index
-                # The LLM channel is usually on channel 2
-                channel_num = 2  # Default to channel 2 for LLM communication
-                logger.warning(f"Channel {channel_name} not found in local node, using default channel index {channel_num}")
-            
-            # Send each chunk to the channel
+            channel_num = self._find_channel_index(channel_name)
+        except Exception as e:
+            logger.error(f"Error sending message to channel {channel_name}: {str(e)}")
+            return False
+        
+        # Send each chunk to the channel
+        with self._send_lock:
             for i, chunk in enumerate(chunks):
-                try:
-                    logger.info(f"Sending message to channel {channel_name} (index {channel_num}): {chunk}")
-                    self.interface.sendText(chunk, channelIndex=channel_num)
-                    
-                    # Add delay between chunks
-                    if i < len(chunks) - 1:
-                        time.sleep(1)
+                for attempt in range(SEND_ATTEMPTS):
+                    try:
+                        logger.info(f"Sending message to channel {channel_name} (index {channel_num}): {chunk}")
+                        self.interface.sendText(chunk, channelIndex=channel_num)
+                        break
                         
-                except (BrokenPipeError, ConnectionResetError) as e:
-                    logger.error(f"Connection error sending message to channel {channel_name}: {str(e)}")
-                    
-                    # Attempt to reconnect
-                    if self._ensure_connected():
+                    except (BrokenPipeError, ConnectionResetError) as e:
+                        logger.error(f"Connection error sending message to channel {channel_name}: {str(e)}")
+                        
+                        # Reconnect and resend this chunk; the ones before it already went out
+                        self.disconnect()
+                        if attempt == SEND_ATTEMPTS - 1 or not self._ensure_connected():
+                            return False
                         logger.info(f"Reconnected, retrying message to channel {channel_name}")
-                        # Recursive call with one less retry
-                        return self.send_to_channel(message, channel_name)
-                    else:
-                        return False
                         
-                except Exception as e:
-                    logger.error(f"Error sending message to channel {channel_name}: {str(e)}")
-                    return False
+                    except Exception as e:
+                        logger.error(f"Error sending message to channel {channel_name}: {str(e)}")
+                        return False
+                
+                # Add delay between chunks
+                if i < len(chunks) - 1:
+                    if self._stop_event.wait(1):
+                        return False
                     
             return True
-            
-        except Exception as e:
-            logger.error(f"Error sending message to channel {channel_name}: {str(e)}")
-            if self._ensure_connected():
-                logger.info(f"Reconnected, retrying message to channel {channel_name}")
-                return self.send_to_channel(message, channel_name)
-            return False
     
     def set_message_callback(self, callback: Callable[[Dict[str, Any]], str]):
         """
@@ -417,32 +668,43 @@ class MeshtasticTcpClient:
         Process incoming messages from the queue
         """
         while self.running:
+            # Wait for a message; stop() sets the event too, so no timeout is needed
+            if not self.message_queue:
+                self._msg_event.wait()
+                self._msg_event.clear()
+                continue
+            
+            message = self.message_queue.popleft()
             try:
-                # Get message from queue with timeout
-                message = self.message_queue.get(timeout=1.0)
-                
                 if self.message_callback:
-                    # Process message with callback
+                    # Process message with callback; it may send its response
+                    # itself through send_response()
                     logger.info(f"Processing message: {message['text']}")
                     response = self.message_callback(message)
-                    
-                    # Send response back
                     if response:
-                        # In private mode or if it was a direct message, respond directly to the sender
-                        # Otherwise, broadcast the response
-                        if self.private_mode or message.get("is_direct", False):
-                            self.send_message(response, message.get("from_id"))
-                        else:
-                            self.send_message(response)
+                        self.send_response(response, message)
                 
-                self.message_queue.task_done()
-                
-            except queue.Empty:
-                # No messages, continue
-                pass
             except Exception as e:
                 logger.error(f"Error in message processing thread: {str(e)}")
     
+    def send_response(self, response: str, message: Dict[str, Any]) -> bool:
+        """
+        Send a response to a previously received message
+        
+        In private mode or if it was a direct message, respond directly to the
+        sender. Otherwise, broadcast the response.
+        
+        Args:
+            response: Response text
+            message: Message dict the response answers
+            
+        Returns:
+            bool: True if the response was sent successfully, False otherwise
+        """
+        if self.private_mode or message.get("is_direct", False):
+            return self.send_message(response, message.get("from_id"))
+        return self.send_message(response)
+    
     def start(self):
         """
         Start the message processing thread
@@ -452,6 +714,7 @@ class MeshtasticTcpClient:
             return False
         
         self.running = True
+        self._stop_event.clear()
         
         # Start message processing thread
         self.message_thread = threading.Thread(target=self._process_messages)
@@ -466,6 +729,8 @@ class MeshtasticTcpClient:
         Stop the message processing thread
         """
         self.running = False
+        self._stop_event.set()
+        self._msg_event.set()
         
         # Wait for thread to finish
         if self.message_thread and self.message_thread.is_alive():
@@ -1,15 +1,50 @@
 import os
 import logging
-from typing import Union, Optional, List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Optional, List, Dict, Any, Iterator
+
+# Models loaded by ID are pulled from the Hugging Face Hub by from_pretrained();
+# use the Rust hf_transfer engine for that download when it is installed.
+# This has to be set before huggingface_hub (or transformers) is imported.
+try:
+    import hf_transfer  # noqa: F401
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+except ImportError:
+    pass
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, Pipeline, TextIteratorStreamer
-from transformers import pipeline
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, Pipeline, TextIteratorStreamer
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Accepted values for ModelLoader's quant_format (None picks a default for the device)
+QUANT_FORMATS = ("gptq", "awq", "fp8", "bnb4", "none")
+
+# Accepted values for ModelLoader's backend (ignored for GGUF models)
+BACKENDS = ("transformers", "vllm")
+
+# Maximum number of weight files read at the same time by preload()
+PRELOAD_WORKERS = 8
+
+class _LockedTextIteratorStreamer(TextIteratorStreamer):
+    """
+    TextIteratorStreamer that decodes while holding the tokenizer lock
+    """
+    def __init__(self, tokenizer, lock, **kwargs):
+        super().__init__(tokenizer, **kwargs)
+        self._lock = lock
+    
+    def put(self, value):
+        with self._lock:
+            super().put(value)
+    
+    def end(self):
+        with self._lock:
+            super().end()
+
 class ModelLoader:
     def __init__(
         self,
@@ -17,27 +52,148 @@ class ModelLoader:
         local_path: Optional[str] = None,
         use_gguf: bool = False,
         device: str = "cuda" if torch.cuda.is_available() else "cpu",
+        quant_format: Optional[str] = None,
+        backend: str = "transformers",
         **kwargs
     ):
+        if quant_format is not None and quant_format not in QUANT_FORMATS:
+            raise ValueError(f"Unknown quant_format {quant_format!r}, expected one of {QUANT_FORMATS}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        
         self.model_id = model_id
         self.local_path = local_path
         self.use_gguf = use_gguf
         self.device = device
+        self.quant_format = quant_format
+        self.backend = backend
         self.kwargs = kwargs
         
         self.model = None
         self.tokenizer = None
         self.pipeline = None
         
+        # Fast tokenizers are not safe to share between threads: a padded call
+        # reconfigures the underlying Rust tokenizer and a concurrent encode then
+        # fails with "Already borrowed". Agent worker threads count tokens while
+        # the batch thread generates, so every use of self.tokenizer holds this.
+        self._tokenizer_lock = threading.RLock()
+        
+        # vLLM's offline engine is not re-entrant; this serializes its generate() calls.
+        # It only encodes prompts without padding, so it does not take the tokenizer lock.
+        self._engine_lock = threading.Lock()
+        
+        # Background page-cache warmup of the weight files
+        self._preload_thread = None
+        self._preload_stop = threading.Event()
+        
         logger.info(f"Initializing model loader for {model_id}")
         logger.info(f"Using device: {device}")
 
+    def preload(self):
+        """
+        Start reading the local model weights into the page cache in the background
+        
+        Loading a multi-GB model is mostly waiting on disk reads. Reading ahead on a
+        separate thread lets those reads overlap with the rest of startup and with
+        the loader's own reads.
+        
+        Returns:
+            threading.Thread: The preload thread, or None if there are no local weights
+        """
+        paths = self._local_weight_files()
+        if not paths:
+            return None
+        
+        self._preload_stop.clear()
+        self._preload_thread = threading.Thread(target=self._preload_files, args=(paths,), name="model-preload")
+        self._preload_thread.daemon = True
+        self._preload_thread.start()
+        return self._preload_thread
+    
+    def stop_preload(self):
+        """
+        Stop the background preload, e.g. once the model has finished loading
+        """
+        self._preload_stop.set()
+    
+    def _local_weight_files(self) -> List[str]:
+        """
+        List the local weight files for the configured model
+        """
+        if not self.local_path or not os.path.exists(self.local_path):
+            return []
+        
+        if os.path.isfile(self.local_path):
+            return [self.local_path]
+        
+        return [
+            os.path.join(self.local_path, name)
+            for name in sorted(os.listdir(self.local_path))
+            if name.endswith((".gguf", ".safetensors", ".bin"))
+        ]
+    
+    def _preload_files(self, paths: List[str]):
+        """
+        Read files so their pages are cached when the loader needs them
+        
+        Sharded checkpoints are read concurrently, one file per worker, so the
+        reads can use the full bandwidth of the disk instead of one stream.
+        """
+        if len(paths) == 1:
+            self._preload_file(paths[0])
+            return
+        
+        with ThreadPoolExecutor(max_workers=min(len(paths), PRELOAD_WORKERS),
+                                thread_name_prefix="model-preload") as executor:
+            # Consume the results so worker exceptions are not silently dropped
+            for _ in executor.map(self._preload_file, paths):
+                pass
+    
+    def _preload_file(self, path: str):
+        """
+        Read one file sequentially into the page cache
+        """
+        chunk_size = 8 * 1024 * 1024
+        buffer = bytearray(chunk_size)
+        
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            logger.warning(f"Could not preload {path}: {str(e)}")
+            return
+        
+        try:
+            size = os.fstat(fd).st_size
+            
+            # Ask the kernel to start readahead for the whole file
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+            
+            offset = 0
+            while offset < size and not self._preload_stop.is_set():
+                if hasattr(os, "preadv"):
+                    read = os.preadv(fd, [buffer], offset)
+                else:
+                    read = len(os.pread(fd, chunk_size, offset))
+                if not read:
+                    break
+                offset += read
+            
+            logger.debug(f"Preloaded {offset / (1024 * 1024):.2f} MB of {path}")
+        except OSError as e:
+            logger.warning(f"Error preloading {path}: {str(e)}")
+        finally:
+            os.close(fd)
+    
     def load_model(self):
         """
-        Load the model either using transformers or llama-cpp-python based on format
+        Load the model using transformers, vLLM or llama-cpp-python based on format and backend
         """
         if self.use_gguf:
             return self._load_gguf_model()
+        elif self.backend == "vllm":
+            return self._load_vllm_model()
         else:
             return self._load_transformers_model()
     
@@ -70,47 +226,17 @@ class ModelLoader:
                 torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
                 device_map="auto",
                 trust_remote_code=True,
-                load_in_4bit=True if self.device == "cuda" else False,
+                **self._quantization_kwargs(model_path)
             )
             
-            # Create pipeline with proper settings for the specific model family
-            if "qwen" in model_path.lower() or "deepseek" in model_path.lower():
-                logger.info("Detected Qwen/DeepSeek model, using specialized settings")
-                
-                # Define a custom generation function for Qwen/DeepSeek models
-                def generate_text(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9):
-                    inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-                    
-                    # Generate with appropriate parameters
-                    outputs = self.model.generate(
-                        **inputs,
-                        max_new_tokens=max_new_tokens,
-                        temperature=temperature,
-                        top_p=top_p,
-                        do_sample=temperature > 0,
-                        pad_token_id=self.tokenizer.pad_token_id
-                    )
-                    
-                    # Decode the generated tokens
-                    generated_text = self.tokenizer.decode(
-                        outputs[0][inputs["input_ids"].shape[1]:], 
-                        skip_special_tokens=True
-                    )
-                    
-                    return generated_text
-                
-                # Store the custom generate function
-                self.pipeline = generate_text
-            else:
-                # Standard pipeline for other models
-                self.pipeline = pipeline(
-                    "text-generation",
-                    model=self.model,
-                    tokenizer=self.tokenizer,
-                    torch_dtype=torch.float16 if self.device == "cuda" else torch.float32,
-                    device_map="auto",
-                    return_full_text=False
-                )
+            # Generate through model.generate() directly rather than a transformers
+            # pipeline, so only tokenizing and decoding hold the tokenizer lock and
+            # agent threads can count tokens while the model runs
+            def generate_text(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9):
+                return "".join(self._stream_transformers(prompt, max_new_tokens, temperature, top_p))
+            
+            # Store the generate function as our "pipeline"
+            self.pipeline = generate_text
             
             logger.info("Successfully loaded model with transformers")
             return True
@@ -121,6 +247,122 @@ class ModelLoader:
             logger.error(traceback.format_exc())
             return False
     
+    def _load_vllm_model(self):
+        """
+        Load model using vLLM
+        
+        vLLM schedules every sequence it is given with continuous batching and
+        PagedAttention, so generate_batch() hands it all prompts in one call.
+        """
+        logger.info("Loading model with vLLM")
+        
+        # Determine the model path (local or from HuggingFace)
+        model_path = self.local_path if self.local_path else self.model_id
+        
+        try:
+            from vllm import LLM, SamplingParams
+            
+            # Pre-quantized checkpoints are detected by vLLM from their config
+            quantization = self.quant_format if self.quant_format in ("gptq", "awq", "fp8") else None
+            
+            logger.info(f"Loading model from {model_path}")
+            self.model = LLM(
+                model=model_path,
+                dtype="auto",
+                quantization=quantization,
+                trust_remote_code=True,
+                gpu_memory_utilization=0.9,
+                max_model_len=4096
+            )
+            self.tokenizer = self.model.get_tokenizer()
+            
+            # Create a wrapper function to match the transformers interface
+            def generate_text(prompt, max_new_tokens=512, temperature=0.7, top_p=0.9):
+                sampling_params = SamplingParams(temperature=temperature, top_p=top_p, max_tokens=max_new_tokens)
+                with self._engine_lock:
+                    return self.model.generate([prompt], sampling_params, use_tqdm=False)[0].outputs[0].text
+            
+            # Store the generate function as our "pipeline"
+            self.pipeline = generate_text
+            
+            logger.info("Successfully loaded model with vLLM")
+            return True
+            
+        except ImportError as e:
+            logger.error(f"Error importing vLLM: {str(e)}")
+            logger.info("Try installing with: pip install vllm")
+            return False
+        except Exception as e:
+            logger.exception("Error loading model with vLLM: %s", e)
+            return False
+    
+    def _quantization_kwargs(self, model_path: str) -> Dict[str, Any]:
+        """
+        Pick the quantization arguments for from_pretrained()
+        
+        Checkpoints that ship pre-quantized weights (GPTQ, AWQ, FP8) carry a
+        quantization_config and are loaded as they are, so transformers runs their
+        fused low-bit kernels. Anything else is quantized on load according to
+        quant_format, which defaults to bitsandbytes 4-bit on CUDA.
+        
+        Args:
+            model_path: Local path or HuggingFace model ID
+            
+        Returns:
+            Dict[str, Any]: Extra keyword arguments for from_pretrained()
+        """
+        try:
+            model_config = AutoConfig.from_pretrained(model_path, trust_remote_code=True)
+            quant_config = getattr(model_config, "quantization_config", None)
+        except Exception as e:
+            logger.warning(f"Could not read model config from {model_path}: {str(e)}")
+            quant_config = None
+        
+        if quant_config:
+            if isinstance(quant_config, dict):
+                method = quant_config.get("quant_method", "unknown")
+            else:
+                method = getattr(quant_config, "quant_method", "unknown")
+            logger.info(f"Model is pre-quantized ({method}), loading its weights as they are")
+            return {}
+        
+        quant_format = self.quant_format
+        if quant_format is None:
+            quant_format = "bnb4" if self.device == "cuda" else "none"
+        
+        if quant_format == "none":
+            return {}
+        
+        if quant_format in ("gptq", "awq"):
+            logger.warning(f"quant_format={quant_format} needs a pre-quantized checkpoint, loading {model_path} unquantized")
+            return {}
+        
+        if self.device != "cuda":
+            logger.warning(f"quant_format={quant_format} needs CUDA, loading {model_path} unquantized")
+            return {}
+        
+        if quant_format == "fp8":
+            try:
+                from transformers import TorchAoConfig
+                from torchao.quantization import Float8WeightOnlyConfig
+            except ImportError as e:
+                logger.error(f"FP8 quantization is not available: {str(e)}")
+                logger.info("Try installing with: pip install torchao")
+                return {}
+            logger.info("Quantizing weights to FP8 on load")
+            return {"quantization_config": TorchAoConfig(quant_type=Float8WeightOnlyConfig())}
+        
+        from transformers import BitsAndBytesConfig
+        logger.info("Quantizing weights to 4-bit NF4 with bitsandbytes on load")
+        return {
+            "quantization_config": BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16,
+                bnb_4bit_use_double_quant=True
+            )
+        }
+    
     def _load_gguf_model(self):
         """
         Load model using llama-cpp-python (for GGUF format)
@@ -156,6 +398,14 @@ class ModelLoader:
                 verbose=False          # Disable verbose output
             )
             
+            # Keep KV state for previous prompts so a shared prefix (system prompt and
+            # earlier turns) does not have to be evaluated again on the next turn
+            try:
+                from llama_cpp import LlamaRAMCache
+                self.model.set_cache(LlamaRAMCache())
+            except ImportError:
+                logger.warning("LlamaRAMCache not available, prompt prefixes will not be cached")
+            
             # Create a wrapper function to match the transformers interface
             def generate_text(prompt, max_new_tokens=100, temperature=0.7, top_p=0.9):
                 result = self.model(
@@ -186,6 +436,26 @@ class ModelLoader:
             logger.error(traceback.format_exc())
             return False
     
+    def tokenize(self, text: str) -> List[int]:
+        """
+        Tokenize text with the loaded model's tokenizer
+        
+        Args:
+            text: Text to tokenize
+            
+        Returns:
+            List[int]: Token IDs, without any BOS token
+        """
+        if self.use_gguf:
+            if not self.model:
+                raise RuntimeError("Model not loaded. Call load_model() first.")
+            return self.model.tokenize(text.encode("utf-8"), add_bos=False)
+        
+        if not self.tokenizer:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        with self._tokenizer_lock:
+            return self.tokenizer.encode(text, add_special_tokens=False)
+    
     def generate(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, top_p: float = 0.9) -> str:
         """
         Generate text with the loaded model
@@ -194,29 +464,87 @@ class ModelLoader:
             raise RuntimeError("Model not loaded. Call load_model() first.")
         
         try:
-            if self.use_gguf or isinstance(self.pipeline, type(lambda: None)):
-                # For GGUF models or custom generation functions
-                result = self.pipeline(prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
-                return result
-            else:
-                # For transformers pipeline
-                result = self.pipeline(
-                    prompt,
+            # Every backend stores a generation function with the same signature
+            return self.pipeline(prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+                
+        except Exception as e:
+            logger.exception("Error generating text: %s", e)
+            return f"Error generating response: {str(e)}"
+
+    def generate_stream(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.7, top_p: float = 0.9) -> Iterator[str]:
+        """
+        Generate text with the loaded model, yielding it piece by piece as it is decoded
+        
+        Transformers models generate on a background thread and hand decoded text
+        back through a TextIteratorStreamer (generate() joins this same stream);
+        GGUF models use llama-cpp-python's
+        streaming completion. vLLM's offline engine only returns finished
+        sequences, so it yields the whole completion at once.
+        
+        Args:
+            prompt: Prompt to complete
+            max_new_tokens: Maximum number of tokens to generate
+            temperature: Temperature for sampling
+            top_p: Top-p for nucleus sampling
+            
+        Returns:
+            Iterator[str]: Pieces of generated text, in order
+        """
+        if not self.pipeline:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        if self.use_gguf:
+            for chunk in self.model(prompt, max_tokens=max_new_tokens, temperature=temperature,
+                                    top_p=top_p, echo=False, stream=True):
+                yield chunk["choices"][0]["text"]
+            return
+        
+        if self.backend == "vllm":
+            yield self.pipeline(prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+            return
+        
+        yield from self._stream_transformers(prompt, max_new_tokens, temperature, top_p)
+    
+    def _stream_transformers(self, prompt: str, max_new_tokens: int, temperature: float, top_p: float) -> Iterator[str]:
+        """
+        Run model.generate() on a background thread and yield its text as it is decoded
+        
+        Only tokenizing and decoding take the tokenizer lock. An exception raised
+        by generate() ends the stream and is re-raised here once the thread is done.
+        """
+        with self._tokenizer_lock:
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        streamer = _LockedTextIteratorStreamer(self.tokenizer, self._tokenizer_lock,
+                                               skip_prompt=True, skip_special_tokens=True)
+        errors = []
+        
+        def run_generate():
+            try:
+                self.model.generate(
+                    **inputs,
                     max_new_tokens=max_new_tokens,
                     temperature=temperature,
                     top_p=top_p,
-                    num_return_sequences=1,
                     do_sample=temperature > 0,
-                    pad_token_id=self.tokenizer.eos_token_id
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    streamer=streamer
                 )
-                return result[0]["generated_text"]
-                
-        except Exception as e:
-            logger.error(f"Error generating text: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return f"Error generating response: {str(e)}"
-
+            except Exception as e:
+                errors.append(e)
+                # Unblock the consumer, which would otherwise wait for more text forever
+                streamer.end()
+        
+        thread = threading.Thread(target=run_generate, name="model-generate")
+        thread.daemon = True
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            thread.join()
+        
+        if errors:
+            raise errors[0]
+    
     def generate_response(self, conversation: List[Dict[str, str]], max_new_tokens: int = 512, temperature: float = 0.7, top_p: float = 0.9) -> str:
         """
         Generate a response to a conversation in the format expected by the agent
@@ -235,20 +563,7 @@ class ModelLoader:
             
         try:
             # Format the conversation into a prompt
-            prompt = ""
-            for message in conversation:
-                role = message["role"]
-                content = message["content"]
-                
-                if role == "system":
-                    prompt += f"{content}\n\n"
-                elif role == "user":
-                    prompt += f"Human: {content}\n"
-                elif role == "assistant":
-                    prompt += f"Assistant: {content}\n"
-            
-            # Add the final assistant prefix
-            prompt += "Assistant: "
+            prompt = self._format_prompt(conversation)
             
             # Generate response
             raw_response = self.generate(prompt, max_new_tokens, temperature, top_p)
@@ -259,11 +574,106 @@ class ModelLoader:
             return response
             
         except Exception as e:
-            logger.error(f"Error generating response: {str(e)}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("Error generating response: %s", e)
             return f"Error generating response: {str(e)}"
 
+    def supports_batching(self) -> bool:
+        """
+        Check whether generate_batch() decodes several conversations in one model call
+        
+        Returns:
+            bool: False if generate_batch() would just generate each conversation in turn
+        """
+        return not self.use_gguf
+    
+    def generate_batch(self, conversations: List[List[Dict[str, str]]], max_new_tokens: int = 512, temperature: float = 0.7, top_p: float = 0.9) -> List[str]:
+        """
+        Generate responses to several conversations in a single call
+        
+        Transformers models run one left-padded generate() over the whole batch so
+        the weights are only streamed once per decoding step. llama-cpp-python only
+        exposes single-sequence completion, so GGUF models generate each prompt in turn.
+        
+        Args:
+            conversations: List of conversations in the format accepted by generate_response
+            max_new_tokens: Maximum number of tokens to generate
+            temperature: Temperature for sampling
+            top_p: Top-p for nucleus sampling
+            
+        Returns:
+            List[str]: Generated responses, in the same order as conversations
+        """
+        if not self.pipeline:
+            raise RuntimeError("Model not loaded. Call load_model() first.")
+        
+        # Nothing to batch, or no batched decode available
+        if len(conversations) == 1 or self.use_gguf:
+            return [
+                self.generate_response(conversation, max_new_tokens, temperature, top_p)
+                for conversation in conversations
+            ]
+        
+        try:
+            prompts = [self._format_prompt(conversation) for conversation in conversations]
+            
+            if self.backend == "vllm":
+                from vllm import SamplingParams
+                
+                sampling_params = SamplingParams(temperature=temperature, top_p=top_p, max_tokens=max_new_tokens)
+                with self._engine_lock:
+                    results = self.model.generate(prompts, sampling_params, use_tqdm=False)
+                return [self._clean_response(result.outputs[0].text) for result in results]
+            
+            # The tokenizer pads on the left, so every prompt ends at the same position
+            with self._tokenizer_lock:
+                inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+            
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                do_sample=temperature > 0,
+                pad_token_id=self.tokenizer.pad_token_id
+            )
+            
+            # Strip the (padded) prompt from each sequence and decode the rest
+            prompt_length = inputs["input_ids"].shape[1]
+            with self._tokenizer_lock:
+                texts = [self.tokenizer.decode(output[prompt_length:], skip_special_tokens=True) for output in outputs]
+            return [self._clean_response(text) for text in texts]
+            
+        except Exception as e:
+            logger.exception("Error generating batch of %s responses: %s", len(conversations), e)
+            return [f"Error generating response: {str(e)}"] * len(conversations)
+
+    def _format_prompt(self, conversation: List[Dict[str, str]]) -> str:
+        """
+        Format a conversation into a prompt string
+        
+        Args:
+            conversation: List of conversation messages
+            
+        Returns:
+            str: Prompt ending with the assistant prefix
+        """
+        prompt = ""
+        for message in conversation:
+            role = message["role"]
+            content = message["content"]
+            
+            if role == "system":
+                prompt += f"{content}\n\n"
+            elif role == "user":
+                prompt += f"Human: {content}\n"
+            elif role == "assistant":
+                prompt += f"Assistant: {content}\n"
+        
+        # Add the final assistant prefix
+        prompt += "Assistant: "
+        
+        return prompt
+
     def _clean_response(self, response: str) -> str:
         """
         Clean the model's response